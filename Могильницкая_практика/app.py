@@ -1,102 +1,650 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, g, render_template, request, jsonify, send_file, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
+from flask_sock import Sock
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import os
 import json
 from datetime import datetime
-import pandas as pd
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib.units import inch
 import base64
+import csv
+import io
+import tempfile
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 import uuid
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from history_store import HistoryStore
+from detector import (LuggageDetector, draw_detections, export_model, make_tiles, merge_detections, shift_detections,
+                      MODEL_PATH, CONFIDENCE_THRESHOLD, INFERENCE_MAX_BATCH, INFERENCE_BATCH_TIMEOUT, INFERENCE_TIMEOUT)
+from inference_pool import InferencePool, InferenceQueueFull
+from jobs import JobManager
+from metrics import MetricsRegistry, SIZE_BUCKETS
+from result_cache import ResultCache, make_cache_key
+from storage import MediaStore, cleanup_folder, write_thumbnail
+from roi import RoiConfig, crop_to_roi, map_from_roi, roi_region
+from video_processing import (create_frame_gate, create_tracker, iter_video_detections, IMAGE_EXTENSIONS,
+                              VIDEO_EXTENSIONS, VIDEO_BATCH_SIZE)
 
 app = Flask(__name__)
 CORS(app)
+sock = Sock(app)
 
 # Настройки
 UPLOAD_FOLDER = 'uploads'
 RESULTS_FOLDER = 'results'
-HISTORY_FILE = 'history.json'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'mp4', 'avi', 'mov'}
+HISTORY_FILE = 'history.json'  # Старый формат истории, переносится в базу при первом запуске
+HISTORY_DB = 'history.db'
+ALLOWED_EXTENSIONS = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
+# Кодеки результата по порядку: H.264 воспроизводится браузером, mp4v - запасной, если сборка OpenCV без H.264
+VIDEO_CODECS = ('avc1', 'mp4v')
+MAX_BATCH_FILES = 32  # Максимум изображений в одном запросе /api/process-batch
+HISTORY_PAGE_SIZE = 50  # Размер страницы /api/history по умолчанию
+HISTORY_MAX_PAGE_SIZE = 500
+RESULT_CACHE_MAX_AGE = 31536000  # Результаты неизменяемы (уникальные имена), кэшируются браузером на год
+SAVE_UPLOADS = True  # Сохранять ли исходные изображения в UPLOAD_FOLDER (запись идет в фоне, одинаковые файлы - один раз)
+# 'thumbnail' - на диск пишется миниатюра, полный результат рисуется по запросу из исходника и рамок в истории;
+# 'full' - полноразмерный аннотированный JPEG в RESULTS_FOLDER
+ANNOTATION_STORAGE = 'thumbnail'
+THUMBNAIL_MAX_SIDE = 480  # Длинная сторона миниатюры результата в пикселях
+UPLOADS_MAX_BYTES = 10 * 1024 ** 3  # Предельный объем UPLOAD_FOLDER, сверх него удаляются самые старые файлы
+RESULTS_MAX_BYTES = 2 * 1024 ** 3  # Предельный объем RESULTS_FOLDER (без отчетов, у них своя очистка)
+STORAGE_MAX_AGE = 30 * 24 * 3600  # Сколько секунд хранить исходники и результаты
+STORAGE_CLEANUP_INTERVAL = 600  # Период фоновой очистки в секундах
+
+# Инференс в отдельных процессах (0 - модель в процессе веб-сервера);
+# размер батча и таймауты пула общие с bulk_process.py и заданы в detector.py
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', os.cpu_count() or 1))
+INFERENCE_QUEUE_SIZE = 64  # Максимум изображений в очереди, сверх него - HTTP 429
+# Бэкенд модели: torch (.pt как есть), onnx (ONNX Runtime) или openvino; экспорт кэшируется в models/
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+INFERENCE_HALF = os.environ.get('INFERENCE_HALF', '0') == '1'  # Экспорт в FP16 (OpenVINO на CPU, ONNX только на GPU)
+# Входит в ключ кэша результатов (исходная модель PyTorch всегда работает в FP32)
+MODEL_ID = f"{MODEL_PATH}:{INFERENCE_BACKEND}:{'fp16' if INFERENCE_HALF and INFERENCE_BACKEND != 'torch' else 'fp32'}"
+JOB_WORKERS = 2  # Потоки для фоновых задач /api/jobs
+MAX_JOBS = 1000  # Сколько последних задач хранить для опроса статуса
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Объем кэша результатов в памяти
+RESULT_CACHE_DIR = None  # Каталог дискового уровня кэша (None - только память)
+RESULT_CACHE_DISK_MAX_BYTES = 2 * 1024 ** 3  # Объем дискового уровня кэша
+# Нарезка кадров высокого разрешения на тайлы (параметр tiled=1): мелкий багаж не теряется при уменьшении кадра
+TILED_INFERENCE = False  # Режим по умолчанию
+TILE_SIZE = 640  # Сторона тайла в пикселях (совпадает с входом модели - тайл не масштабируется)
+TILE_OVERLAP = 0.2  # Доля перекрытия соседних тайлов
+TILE_MERGE_THRESHOLD = 0.5  # Порог перекрытия (к меньшей рамке) для слияния детекций соседних тайлов
+# Пропуск инференса для неизменившихся кадров видео и live-потока (параметр gate=0 отключает);
+# чувствительность фильтра и линия подсчета трекера общие с bulk_process.py и заданы в video_processing.py
+FRAME_GATING = True
+FRAME_GATE_MAX_SOURCES = 256  # Сколько источников (параметр source в /api/process) помнить
+CAMERA_ROI_FILE = 'camera_roi.json'  # Области интереса камер (параметр source), задаются через /api/cameras/<source>/roi
+REPORT_CSV_CHUNK_ROWS = 1000  # Строк CSV в одном фрагменте потокового ответа
+EXCEL_MAX_ROWS = 1048576  # Предел строк листа Excel: дальше отчет продолжается на следующем листе
+REPORTS_FOLDER = os.path.join(RESULTS_FOLDER, 'reports')  # Сгенерированные отчеты (с ограниченным хранением)
+REPORT_MAX_FILES = 50  # Сколько файлов отчетов хранить
+REPORT_MAX_AGE = 7 * 24 * 3600  # Сколько секунд хранить файл отчета
+
+# Столбцы табличного отчета и их ширина в Excel (ширина задается до записи строк,
+# как требует режим write_only; длинные столбцы ограничены 50 символами, как и раньше)
+REPORT_COLUMNS = [
+    ('Дата и время', 21),
+    ('Файл', 50),
+    ('Количество багажа', 19),
+    ('Объекты', 50)
+]
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
+os.makedirs(REPORTS_FOLDER, exist_ok=True)
+
+history_store = HistoryStore(HISTORY_DB)
+history_store.import_json(HISTORY_FILE)
+upload_writer = ThreadPoolExecutor(max_workers=1)  # Фоновая запись исходных загрузок на диск
+job_manager = JobManager(JOB_WORKERS, MAX_JOBS)
+result_cache = ResultCache(RESULT_CACHE_MAX_BYTES, RESULT_CACHE_DIR, RESULT_CACHE_DISK_MAX_BYTES)
+media_store = MediaStore(UPLOAD_FOLDER)
+roi_config = RoiConfig(CAMERA_ROI_FILE)
+
+# Метрики для /metrics: длительность этапов, размеры загрузок, детекции и ошибки
+metrics = MetricsRegistry()
+upload_size_metric = metrics.histogram('luggage_upload_bytes', 'Размер загруженного изображения или кадра',
+                                       buckets=SIZE_BUCKETS)
+stage_metric = metrics.histogram('luggage_stage_seconds', 'Длительность этапа обработки', label='stage')
+batch_size_metric = metrics.histogram('luggage_inference_batch_size', 'Размер батча модели',
+                                      buckets=(1, 2, 4, 8, 16, 32))
+request_metric = metrics.histogram('luggage_request_seconds', 'Длительность HTTP-запроса', label='endpoint')
+detections_metric = metrics.counter('luggage_detections_total', 'Обнаруженные объекты по классам', label='class')
+skipped_metric = metrics.counter('luggage_inference_skipped_total', 'Кадры без вызова модели (кадр не изменился)',
+                                 label='source')
+storage_removed_metric = metrics.counter('luggage_storage_removed_bytes_total', 'Байты, удаленные очисткой хранилища',
+                                         label='folder')
+errors_metric = metrics.counter('luggage_errors_total', 'Ошибки обработки по типу исключения', label='type')
+metrics.gauge('luggage_inference_queue_depth', 'Изображения в очереди инференса',
+              lambda: inference_pool.queue_depth() if inference_pool is not None else 0)
+metrics.gauge('luggage_jobs_pending', 'Фоновые задачи в очереди и в работе', lambda: job_manager.pending_count())
+metrics.gauge('luggage_model_ready', 'Модель загружена и прогрета', lambda: int(model_ready()))
+metrics.gauge('luggage_result_cache_bytes', 'Объем кэша результатов в памяти', lambda: result_cache.stats()['bytes'])
+
+def record_stage_timings(timings):
+    """Длительность этапов инференса, измеренная моделью (в воркере или в этом процессе)"""
+    stage_metric.observe(timings['inference'], 'inference')
+    stage_metric.observe(timings['postprocess'], 'postprocess')
+    batch_size_metric.observe(timings['batch_size'])
+
+def record_error(error):
+    errors_metric.inc(type(error).__name__)
+
+def load_detector():
+    """Модель в процессе веб-сервера: экспорт под бэкенд (один раз) и прогрев"""
+    local_detector = LuggageDetector(export_model(MODEL_PATH, INFERENCE_BACKEND, INFERENCE_HALF))
+    local_detector.warmup((1, VIDEO_BATCH_SIZE))
+    return local_detector
+
+# Модель YOLO загружается при первом обращении (при работе через пул процессов модель живет в воркерах)
+detector = None
+detector_lock = threading.Lock()
+detect_lock = threading.Lock()  # Предиктор ultralytics не потокобезопасен: вызовы модели в процессе по одному
+
+def get_detector():
+    """Модель в процессе веб-сервера, создается один раз при первом запросе"""
+    global detector
+    with detector_lock:
+        if detector is None:
+            detector = load_detector()
+        return detector
+
+def model_ready():
+    """Прогрета ли модель (хотя бы один воркер пула готов принимать задачи)"""
+    if INFERENCE_WORKERS == 0:
+        return detector is not None
+    return inference_pool is not None and inference_pool.ready_workers() > 0
+
+warmup_started = False
+warmup_error = None  # Ошибка фоновой загрузки модели (отдается в /api/ready)
+warmup_lock = threading.Lock()  # Отдельно от detector_lock: тот занят на все время загрузки модели
+
+def start_model_warmup():
+    """Загрузка и прогрев модели в фоне, без блокировки запуска сервера и /api/ready
+    (повторный вызов ничего не делает)"""
+    global warmup_started
+    with warmup_lock:
+        if warmup_started:
+            return
+        warmup_started = True
+    # Экспорт модели для пула тоже может идти долго, поэтому и пул создается в фоне;
+    # воркеры загружают модель в своих процессах
+    threading.Thread(target=run_model_warmup, daemon=True).start()
 
-# Загрузка предобученной модели YOLO
-# Используем YOLOv8, которая хорошо детектирует объекты (включая сумки, чемоданы)
-model = YOLO('yolov8n.pt')  # nano версия для быстрой работы
+def run_model_warmup():
+    global warmup_error
+    try:
+        if INFERENCE_WORKERS == 0:
+            get_detector()
+        else:
+            get_inference_pool()
+    except Exception as e:
+        record_error(e)
+        warmup_error = str(e)
+
+def model_failure():
+    """Почему модель не сможет стать готовой (None, если такой ошибки нет)"""
+    if inference_pool is not None and inference_pool.failure():
+        return inference_pool.failure()
+    return warmup_error
+
+inference_pool = None
+inference_pool_lock = threading.Lock()
+
+def get_inference_pool():
+    """Пул воркеров создается при первом обращении, а не при импорте модуля"""
+    global inference_pool
+    with inference_pool_lock:
+        if inference_pool is None:
+            # Экспорт выполняется здесь, до запуска воркеров, чтобы они не собирали модель одновременно
+            model_file = export_model(MODEL_PATH, INFERENCE_BACKEND, INFERENCE_HALF)
+            inference_pool = InferencePool(model_file, INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE,
+                                           INFERENCE_MAX_BATCH, INFERENCE_BATCH_TIMEOUT,
+                                           on_timings=record_stage_timings)
+            atexit.register(inference_pool.shutdown)
+        return inference_pool
+
+def infer_images(images, conf_threshold, wait=False):
+    """Один вызов модели: через пул воркеров или модель в текущем процессе"""
+    # inference_total - полное время ожидания результата, включая очередь и передачу между процессами
+    with stage_metric.time('inference_total'):
+        if INFERENCE_WORKERS == 0:
+            timings = {'batch_size': len(images)}
+            local_detector = get_detector()
+            with detect_lock:
+                detections = local_detector.detect(images, conf_threshold, timings)
+            record_stage_timings(timings)
+            return detections
+        return get_inference_pool().infer(images, conf_threshold, wait=wait, timeout=INFERENCE_TIMEOUT)
+
+def infer_tiled(images, conf_threshold, wait=False):
+    """Инференс по тайлам: целый кадр (для крупного багажа) и перекрывающиеся тайлы
+    всех изображений идут в модель одним батчем, результаты сливаются NMS между тайлами"""
+    inputs, owners = [], []
+    for index, img in enumerate(images):
+        inputs.append((0, 0, img))
+        owners.append(index)
+        if max(img.shape[:2]) > TILE_SIZE:
+            tiles = make_tiles(img, TILE_SIZE, TILE_OVERLAP)
+            inputs.extend(tiles)
+            owners.extend([index] * len(tiles))
+    
+    detections = infer_images([tile for _, _, tile in inputs], conf_threshold, wait)
+    merged = [[] for _ in images]
+    for index, (x, y, _), detected_objects in zip(owners, inputs, detections):
+        merged[index].extend(shift_detections(detected_objects, x, y) if x or y else detected_objects)
+    return [merge_detections(detected_objects, TILE_MERGE_THRESHOLD) for detected_objects in merged]
+
+def run_inference(images, conf_threshold=CONFIDENCE_THRESHOLD, wait=False, tiled=False, roi=None):
+    """Детекции багажа для каждого изображения (tiled - нарезка на тайлы для кадров высокого разрешения).
+    С ROI в модель идет только область ленты, рамки возвращаются в координатах полного кадра"""
+    inputs = images
+    if roi is not None:
+        crops = [crop_to_roi(img, roi) for img in images]
+        inputs = [crop for crop, _, _ in crops]
+    if tiled:
+        detections = infer_tiled(inputs, conf_threshold, wait)
+    else:
+        detections = infer_images(inputs, conf_threshold, wait)
+    if roi is not None:
+        detections = [
+            map_from_roi(detected_objects, roi, dx, dy, img.shape)
+            for img, (_, dx, dy), detected_objects in zip(images, crops, detections)
+        ]
+    for detected_objects in detections:
+        for obj in detected_objects:
+            detections_metric.inc(obj['class'])
+    return detections
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def load_history():
-    """Загрузка истории запросов"""
-    if os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
-
 def save_history(entry):
     """Сохранение записи в историю"""
-    history = load_history()
-    history.append(entry)
-    with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(history, f, ensure_ascii=False, indent=2)
+    with stage_metric.time('history_write'):
+        history_store.append(entry)
+
+def is_video_file(filename):
+    return filename.rsplit('.', 1)[1].lower() in VIDEO_EXTENSIONS
 
-def detect_luggage(image_path):
-    """Детектирование багажа на изображении"""
+def request_conf_threshold():
+    """Порог уверенности из параметра запроса conf (0..1)"""
+    try:
+        conf = float(request.values.get('conf', CONFIDENCE_THRESHOLD))
+    except ValueError:
+        return CONFIDENCE_THRESHOLD
+    return min(max(conf, 0.0), 1.0)
+
+def request_flag(name, default=False):
+    """Логический параметр запроса (1/true/yes или 0/false/no)"""
+    value = request.values.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+def request_tiled():
+    """Включен ли инференс по тайлам (параметр tiled=1/0, по умолчанию TILED_INFERENCE)"""
+    return request_flag('tiled', TILED_INFERENCE)
+
+def request_tracking():
+    """Включен ли режим сопровождения (параметр track=1)"""
+    return request_flag('track')
+
+def request_gating():
+    """Включен ли пропуск неизменившихся кадров (параметр gate=1/0, по умолчанию FRAME_GATING)"""
+    return request_flag('gate', FRAME_GATING)
+
+source_gates = OrderedDict()
+source_gates_lock = threading.Lock()
+
+def get_source_gate(source, conf_threshold, tiled, roi=None):
+    """Фильтр кадров для именованного источника (камеры), последние FRAME_GATE_MAX_SOURCES источников"""
+    key = (source, conf_threshold, tiled, json.dumps(roi))
+    with source_gates_lock:
+        gate = source_gates.get(key)
+        if gate is None:
+            gate = source_gates[key] = create_frame_gate()
+            while len(source_gates) > FRAME_GATE_MAX_SOURCES:
+                source_gates.popitem(last=False)
+        source_gates.move_to_end(key)
+        return gate
+
+def request_source_gate(conf_threshold, tiled, roi=None):
+    """Фильтр кадров для параметра source (снимки одной камеры), None без source или при gate=0"""
+    source = request.values.get('source')
+    if not source or not request_gating():
+        return None
+    return get_source_gate(source, conf_threshold, tiled, roi)
+
+def request_roi():
+    """ROI камеры из параметра source (None, если источник не указан или ROI для него не задана)"""
+    source = request.values.get('source')
+    return roi_config.get(source) if source else None
+
+def gate_view(img, roi=None):
+    """Часть кадра для фильтра неизменившихся кадров: изменения сравниваются только внутри ROI
+    (люди у ленты не в счет)"""
+    return roi_region(img, roi) if roi is not None else img
+
+def draw_count_line(img, tracker):
+    """Линия подсчета и число уникального багажа на кадре"""
+    height, width = img.shape[:2]
+    if tracker.line_axis == 'x':
+        x = int(tracker.line_position * width)
+        cv2.line(img, (x, 0), (x, height), (0, 0, 255), 2)
+    else:
+        y = int(tracker.line_position * height)
+        cv2.line(img, (0, y), (width, y), (0, 0, 255), 2)
+    cv2.putText(img, f"Unique: {tracker.line_crossings}", (10, 30),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+    return img
+
+def decode_image(data):
+    """Декодирование изображения из байтов в памяти (без записи на диск)"""
+    upload_size_metric.observe(len(data))
+    with stage_metric.time('decode'):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[-1].lower()
+
+def persist_upload(filename, data):
+    """Асинхронное сохранение исходной загрузки, если оно включено.
+    Возвращает ключ исходника в хранилище (одинаковое содержимое - один файл) или None"""
+    if not SAVE_UPLOADS:
+        return None
+    key = media_store.key_for(data, file_extension(filename))
+    upload_writer.submit(media_store.save, key, data)
+    return key
+
+def persist_video_upload(file, unique_filename):
+    """Видео сохраняется на диск (OpenCV читает только файлы) и переносится в хранилище; возвращает путь"""
+    tmp_path = os.path.join(UPLOAD_FOLDER, f"{unique_filename}.tmp")
+    file.save(tmp_path)
+    return media_store.path(media_store.save_file(tmp_path, file_extension(unique_filename)))
+
+def wait_pending_writes():
+    """Ожидание фоновых записей на диск (очередь однопоточная - выполняется по порядку)"""
+    upload_writer.submit(lambda: None).result()
+
+storage_stats = {}
+storage_cleanup_started = False
+storage_cleanup_lock = threading.Lock()
+
+def run_storage_cleanup():
+    """Очистка исходников и результатов по возрасту и объему (отчеты чистит cleanup_reports)"""
+    folders = [
+        ('uploads', UPLOAD_FOLDER, UPLOADS_MAX_BYTES, ()),
+        ('results', RESULTS_FOLDER, RESULTS_MAX_BYTES, (REPORTS_FOLDER,))
+    ]
+    for name, folder, max_bytes, skip_dirs in folders:
+        removed_files, removed_bytes, used_bytes = cleanup_folder(folder, max_bytes, STORAGE_MAX_AGE,
+                                                                  skip_dirs=skip_dirs)
+        storage_removed_metric.inc(name, removed_bytes)
+        storage_stats[name] = {
+            'used_bytes': used_bytes,
+            'max_bytes': max_bytes,
+            'removed_files': removed_files,
+            'removed_bytes': removed_bytes,
+            'checked_at': datetime.now().isoformat()
+        }
+
+def storage_cleanup_loop():
+    while True:
+        try:
+            run_storage_cleanup()
+        except Exception as e:
+            record_error(e)
+        time.sleep(STORAGE_CLEANUP_INTERVAL)
+
+def start_storage_cleanup():
+    """Фоновая очистка запускается один раз, с первым запросом"""
+    global storage_cleanup_started
+    with storage_cleanup_lock:
+        if storage_cleanup_started:
+            return
+        storage_cleanup_started = True
+    threading.Thread(target=storage_cleanup_loop, daemon=True).start()
+
+def detect_luggage(image, conf_threshold=CONFIDENCE_THRESHOLD, tiled=False, roi=None, wait=False):
+    """Детектирование багажа на изображении (путь к файлу или уже декодированный массив).
+    wait - ждать места в очереди инференса вместо InferenceQueueFull"""
     try:
-        # Классы YOLO, связанные с багажом
-        luggage_classes = ['suitcase', 'handbag', 'backpack', 'bag', 'sports ball']
-        luggage_class_ids = [24, 26, 27, 28, 32]  # ID классов в COCO dataset
-        
         # Загрузка изображения
-        img = cv2.imread(image_path)
+        img = cv2.imread(image) if isinstance(image, str) else image
         if img is None:
             return None, [], 0, "Ошибка загрузки изображения"
         
         # Детектирование объектов
-        results = model(image_path)
+        detected_objects = run_inference([img], conf_threshold, wait=wait, tiled=tiled, roi=roi)[0]
+        luggage_count = len(detected_objects)
         
-        detected_objects = []
-        luggage_count = 0
-        
-        for result in results:
-            boxes = result.boxes
-            if boxes is not None:
-                for box in boxes:
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    # Проверяем, является ли объект багажом
-                    if cls_id in luggage_class_ids or result.names[cls_id] in luggage_classes:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        detected_objects.append({
-                            'class': result.names[cls_id],
-                            'confidence': round(conf, 2),
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)]
-                        })
-                        luggage_count += 1
-        
-        # Рисуем bounding boxes на изображении
-        result_img = img.copy()
-        for obj in detected_objects:
-            x1, y1, x2, y2 = obj['bbox']
-            cv2.rectangle(result_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            label = f"{obj['class']} {obj['confidence']:.2f}"
-            cv2.putText(result_img, label, (x1, y1 - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        with stage_metric.time('draw'):
+            result_img = draw_detections(img.copy(), detected_objects)
         
         return result_img, detected_objects, luggage_count, None
+    except InferenceQueueFull:
+        raise
     except Exception as e:
+        record_error(e)
         return None, [], 0, f"Ошибка обработки: {str(e)}"
 
+def detect_luggage_batch(images, conf_threshold=CONFIDENCE_THRESHOLD, tiled=False, roi=None):
+    """Детектирование багажа на нескольких изображениях одним батчем"""
+    detections = run_inference(images, conf_threshold, tiled=tiled, roi=roi)
+    
+    batch_results = []
+    for img, detected_objects in zip(images, detections):
+        with stage_metric.time('draw'):
+            result_img = draw_detections(img.copy(), detected_objects)
+        batch_results.append((result_img, detected_objects, len(detected_objects)))
+    return batch_results
+
+def wants_detections_only():
+    """Режим ответа без base64-изображения (только детекции и ссылка на результат)"""
+    return request.values.get('mode') == 'detections'
+
+def encode_result_image(result_img):
+    """JPEG-кодирование результата (один раз: байты идут на диск, в ответ и в кэш)"""
+    with stage_metric.time('encode'):
+        ok, buffer = cv2.imencode('.jpg', result_img)
+    if not ok:
+        raise ValueError("Ошибка кодирования результата")
+    return buffer.tobytes()
+
+def detect_image_bytes(data, conf_threshold=CONFIDENCE_THRESHOLD, tiled=False, gate=None, roi=None, wait=False):
+    """Детекции и JPEG-результат для байтов изображения с учетом кэша по содержимому
+    и фильтра неизменившихся кадров источника (gate).
+    Возвращает (detected_objects, image_bytes, cached, skipped) или None, если изображение не декодируется"""
+    cache_key = make_cache_key(data, MODEL_ID, conf_threshold, tiled, roi)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        upload_size_metric.observe(len(data))
+        return cached[0], cached[1], True, False
+    
+    img = decode_image(data)
+    if img is None:
+        return None
+    
+    # Кадр источника не изменился - модель не вызывается, рамки опорного кадра рисуются на новом
+    reused, reference = gate.reuse(gate_view(img, roi)) if gate is not None else (None, None)
+    if reused is not None:
+        skipped_metric.inc('image')
+        return reused, encode_result_image(draw_detections(img, reused)), False, True
+    
+    result_img, detected_objects, _, error_msg = detect_luggage(img, conf_threshold, tiled, roi, wait)
+    if result_img is None:
+        raise ValueError(error_msg or 'Ошибка обработки изображения')
+    if gate is not None:
+        gate.remember(detected_objects, reference)
+    
+    image_bytes = encode_result_image(result_img)
+    result_cache.put(cache_key, detected_objects, image_bytes)
+    return detected_objects, image_bytes, False, False
+
+def store_image_result(filename, unique_filename, image_bytes, detected_objects, include_image=True, original=None):
+    """Сохранение результата обработки изображения и запись в историю.
+    original - ключ исходника в хранилище (по нему результат рисуется заново по запросу)"""
+    luggage_count = len(detected_objects)
+    history_entry = {
+        'id': str(uuid.uuid4()),
+        'timestamp': datetime.now().isoformat(),
+        'filename': filename,
+        'luggage_count': luggage_count,
+        'detected_objects': detected_objects,
+        'original': original
+    }
+    
+    stem = os.path.splitext(unique_filename)[0]
+    if ANNOTATION_STORAGE == 'full':
+        result_filename = f"result_{stem}.jpg"
+        history_entry['result_path'] = os.path.join(RESULTS_FOLDER, result_filename)
+        with open(history_entry['result_path'], 'wb') as f:
+            f.write(image_bytes)
+        result_url = f"/results/{result_filename}"
+    else:
+        thumbnail_filename = f"thumb_{stem}.jpg"
+        history_entry['thumbnail_path'] = os.path.join(RESULTS_FOLDER, thumbnail_filename)
+        upload_writer.submit(write_thumbnail, history_entry['thumbnail_path'], image_bytes, THUMBNAIL_MAX_SIDE)
+        result_url = f"/api/history/{history_entry['id']}/image"
+    save_history(history_entry)
+    
+    response = {
+        'success': True,
+        'luggage_count': luggage_count,
+        'detected_objects': detected_objects,
+        'result_url': result_url,
+        'history_id': history_entry['id']
+    }
+    if 'thumbnail_path' in history_entry:
+        response['thumbnail_url'] = f"/results/{os.path.basename(history_entry['thumbnail_path'])}"
+    if include_image:
+        img_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        response['result_image'] = f"data:image/jpeg;base64,{img_base64}"
+    return response
+
+def open_video_writer(result_path, fps, width, height):
+    """Выходное видео с первым доступным кодеком из VIDEO_CODECS"""
+    for codec in VIDEO_CODECS:
+        writer = cv2.VideoWriter(result_path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+        if writer.isOpened():
+            return writer
+        writer.release()
+    raise ValueError("Не удалось создать выходное видео")
+
+def process_video(video_path, result_path, conf_threshold=CONFIDENCE_THRESHOLD, tracker=None, tiled=False, gate=None,
+                  roi=None):
+    """Потоковая обработка видео: кадры подаются в модель батчами,
+    аннотированные кадры пишутся в выходное видео, результат отдается по каждому кадру.
+    С трекером кадры обрабатываются им по порядку и в результат добавляется подсчет уникального багажа.
+    С фильтром кадров (gate) в модель идут только изменившиеся кадры"""
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError("Ошибка открытия видео")
+    
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    try:
+        writer = open_video_writer(result_path, fps, width, height)
+    except ValueError:
+        capture.release()
+        raise
+    
+    def infer(frames):
+        # Видео не отклоняется при заполненной очереди, а ждет освобождения места
+        return run_inference(frames, conf_threshold, wait=True, tiled=tiled, roi=roi)
+
+    changed = (lambda frame: gate.changed(gate_view(frame, roi))) if gate is not None else None
+    try:
+        for frame_index, frame, detected_objects, is_changed, new_crossings in iter_video_detections(
+                capture, infer, VIDEO_BATCH_SIZE, fps, changed, tracker):
+            if not is_changed:
+                skipped_metric.inc('video')
+            frame_result = {
+                'frame': frame_index,
+                'time': round(frame_index / fps, 3),
+                'luggage_count': len(detected_objects),
+                'detected_objects': detected_objects,
+                'inference_skipped': not is_changed
+            }
+            draw_detections(frame, detected_objects)
+            if tracker is not None:
+                frame_result['new_crossings'] = new_crossings
+                frame_result['unique_luggage'] = tracker.line_crossings
+                draw_count_line(frame, tracker)
+            writer.write(frame)
+            yield frame_result
+    finally:
+        capture.release()
+        writer.release()
+
+def process_video_upload(filepath, filename, unique_filename, conf_threshold=CONFIDENCE_THRESHOLD, track=False,
+                         tiled=False, gating=FRAME_GATING, roi=None):
+    """Обработка загруженного видео: результаты по кадрам, затем итог с записью в историю.
+    Ошибка отдается последним сообщением с ключом 'error'"""
+    result_filename = f"result_{unique_filename.rsplit('.', 1)[0]}.mp4"
+    result_path = os.path.join(RESULTS_FOLDER, result_filename)
+    tracker = create_tracker() if track else None
+    gate = create_frame_gate() if gating else None
+    
+    frames_processed = 0
+    peak_objects = []
+    try:
+        for frame_result in process_video(filepath, result_path, conf_threshold, tracker, tiled, gate, roi):
+            frames_processed += 1
+            if frame_result['luggage_count'] > len(peak_objects):
+                peak_objects = frame_result['detected_objects']
+            yield frame_result
+    except Exception as e:
+        yield {'error': f'Ошибка обработки видео: {str(e)}'}
+        return
+    
+    # В историю попадает число уникального багажа (с трекером) или максимум в одном кадре
+    history_entry = {
+        'id': str(uuid.uuid4()),
+        'timestamp': datetime.now().isoformat(),
+        'filename': filename,
+        'media_type': 'video',
+        'frames_processed': frames_processed,
+        'luggage_count': tracker.line_crossings if tracker else len(peak_objects),
+        'detected_objects': peak_objects,
+        'result_path': result_path,
+        'original': os.path.basename(filepath)  # Видео лежит в хранилище под своим ключом
+    }
+    if tracker is not None:
+        history_entry['tracking'] = tracker.summary()
+    save_history(history_entry)
+    
+    summary = {
+        'success': True,
+        'frames_processed': frames_processed,
+        'luggage_count': history_entry['luggage_count'],
+        'detected_objects': peak_objects,
+        'result_video': f"/results/{result_filename}",
+        'history_id': history_entry['id'],
+        'inference_skipped': gate.skipped if gate is not None else 0
+    }
+    if tracker is not None:
+        summary['tracking'] = history_entry['tracking']
+    yield summary
+
+def stream_video_response(filepath, filename, unique_filename, conf_threshold=CONFIDENCE_THRESHOLD, track=False,
+                          tiled=False, gating=FRAME_GATING, roi=None):
+    """NDJSON-ответ с результатами по кадрам и итоговой записью в конце"""
+    def generate():
+        for message in process_video_upload(filepath, filename, unique_filename, conf_threshold, track, tiled,
+                                            gating, roi):
+            yield json.dumps(message, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # Обработчики ошибок для возврата JSON вместо HTML
 @app.errorhandler(404)
 def not_found(error):
@@ -106,11 +654,38 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Внутренняя ошибка сервера'}), 500
 
+@app.errorhandler(InferenceQueueFull)
+def inference_queue_full(error):
+    record_error(error)
+    return jsonify({'error': 'Сервер перегружен, повторите запрос позже'}), 429
+
 @app.errorhandler(Exception)
 def handle_exception(e):
-    # Возвращаем JSON для всех исключений
+    # Возвращаем JSON для всех исключений; HTTP-ошибки (405, 413 и т.д.) сохраняют свой код
+    if isinstance(e, HTTPException):
+        return jsonify({'error': e.description}), e.code
+    record_error(e)
+    app.logger.exception('Необработанная ошибка')
     return jsonify({'error': f'Ошибка: {str(e)}'}), 500
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    start_storage_cleanup()
+
+@app.after_request
+def record_request_time(response):
+    # Для потоковых ответов (видео, NDJSON) - время до начала передачи
+    start = g.get('request_start')
+    if start is not None:
+        request_metric.observe(time.perf_counter() - start, request.endpoint or 'unknown')
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -126,65 +701,309 @@ def process_image():
         return jsonify({'error': 'Файл не выбран'}), 400
     
     if file and allowed_file(file.filename):
-        # Сохранение файла
         filename = secure_filename(file.filename)
         unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(filepath)
         
-        # Обработка изображения
+        # Видео обрабатывается потоково, результат по каждому кадру (OpenCV читает видео только с диска)
+        if is_video_file(file.filename):
+            filepath = persist_video_upload(file, unique_filename)
+            return stream_video_response(filepath, filename, unique_filename, request_conf_threshold(),
+                                         request_tracking(), request_tiled(), request_gating(), request_roi())
+        
+        # Изображение декодируется прямо из запроса (повторные кадры берутся из кэша),
+        # исходник сохраняется в фоне
+        data = file.read()
         try:
-            result_img, detected_objects, luggage_count, error_msg = detect_luggage(filepath)
-            
-            if result_img is None:
-                return jsonify({'error': error_msg or 'Ошибка обработки изображения'}), 500
+            conf_threshold = request_conf_threshold()
+            tiled = request_tiled()
+            roi = request_roi()
+            detection = detect_image_bytes(data, conf_threshold, tiled, request_source_gate(conf_threshold, tiled, roi),
+                                           roi)
+        except InferenceQueueFull:
+            raise
         except Exception as e:
+            record_error(e)
             return jsonify({'error': f'Ошибка при обработке: {str(e)}'}), 500
         
-        # Сохранение результата
-        result_filename = f"result_{unique_filename}"
-        result_path = os.path.join(RESULTS_FOLDER, result_filename)
-        cv2.imwrite(result_path, result_img)
+        if detection is None:
+            return jsonify({'error': 'Ошибка загрузки изображения'}), 400
+        original = persist_upload(filename, data)
+        detected_objects, image_bytes, cached, skipped = detection
         
-        # Сохранение в историю
-        history_entry = {
-            'id': str(uuid.uuid4()),
-            'timestamp': datetime.now().isoformat(),
+        # Сохранение результата и запись в историю
+        response = store_image_result(filename, unique_filename, image_bytes, detected_objects,
+                                      include_image=not wants_detections_only(), original=original)
+        response['cached'] = cached
+        response['inference_skipped'] = skipped
+        return jsonify(response)
+    
+    return jsonify({'error': 'Неподдерживаемый формат файла'}), 400
+
+@app.route('/api/process-batch', methods=['POST'])
+def process_batch():
+    """Обработка нескольких изображений одним батчем модели"""
+    files = [f for f in request.files.getlist('files') if f.filename != '']
+    if not files:
+        return jsonify({'error': 'Файлы не найдены'}), 400
+    if len(files) > MAX_BATCH_FILES:
+        return jsonify({'error': f'Слишком много файлов (максимум {MAX_BATCH_FILES})'}), 400
+    
+    # Декодирование в памяти; изображения из кэша не декодируются и не попадают в батч модели
+    conf_threshold = request_conf_threshold()
+    tiled = request_tiled()
+    roi = request_roi()
+    items = []
+    for file in files:
+        if not allowed_file(file.filename) or is_video_file(file.filename):
+            return jsonify({'error': f'Неподдерживаемый формат файла: {file.filename}'}), 400
+        filename = secure_filename(file.filename)
+        data = file.read()
+        item = {
             'filename': filename,
-            'luggage_count': luggage_count,
-            'detected_objects': detected_objects,
-            'result_path': result_path
+            'unique_filename': f"{uuid.uuid4()}_{filename}",
+            'data': data,
+            'cache_key': make_cache_key(data, MODEL_ID, conf_threshold, tiled, roi),
+            'img': None
         }
-        save_history(history_entry)
+        item['result'] = result_cache.get(item['cache_key'])
+        item['cached'] = item['result'] is not None
+        if item['cached']:
+            upload_size_metric.observe(len(data))
+        else:
+            item['img'] = decode_image(data)
+            if item['img'] is None:
+                return jsonify({'error': f'Ошибка загрузки изображения: {filename}'}), 400
+        items.append(item)
+    
+    for item in items:
+        item['original'] = persist_upload(item['filename'], item['data'])
+    
+    misses = [item for item in items if not item['cached']]
+    if misses:
+        try:
+            batch_results = detect_luggage_batch([item['img'] for item in misses], conf_threshold, tiled, roi)
+        except InferenceQueueFull:
+            raise
+        except Exception as e:
+            record_error(e)
+            return jsonify({'error': f'Ошибка при обработке: {str(e)}'}), 500
+        
+        for item, (result_img, detected_objects, _) in zip(misses, batch_results):
+            image_bytes = encode_result_image(result_img)
+            result_cache.put(item['cache_key'], detected_objects, image_bytes)
+            item['result'] = (detected_objects, image_bytes)
+    
+    include_image = not wants_detections_only()
+    responses = []
+    for item in items:
+        detected_objects, image_bytes = item['result']
+        item_response = store_image_result(item['filename'], item['unique_filename'], image_bytes, detected_objects,
+                                           include_image=include_image, original=item['original'])
+        item_response['filename'] = item['filename']
+        item_response['cached'] = item['cached']
+        responses.append(item_response)
+    
+    return jsonify({
+        'success': True,
+        'total_luggage': sum(r['luggage_count'] for r in responses),
+        'results': responses
+    })
+
+@sock.route('/ws/detect')
+def detect_stream(ws):
+    """Детекция в реальном времени: клиент шлет JPEG-кадры по WebSocket, сервер отвечает только детекциями.
+    Под нагрузкой обрабатывается самый свежий кадр, накопившиеся старые отбрасываются"""
+    conf_threshold = request_conf_threshold()
+    tiled = request_tiled()
+    tracker = create_tracker() if request_tracking() else None
+    gate = create_frame_gate() if request_gating() else None
+    roi = request_roi()
+    processed = 0
+    dropped = 0
+    started = time.monotonic()
+    
+    while True:
+        frame_data = ws.receive()
+        while True:
+            newer = ws.receive(timeout=0)
+            if newer is None:
+                break
+            frame_data = newer
+            dropped += 1
+        if not isinstance(frame_data, bytes):
+            continue
         
-        # Кодирование результата в base64 для отправки
-        _, buffer = cv2.imencode('.jpg', result_img)
-        img_base64 = base64.b64encode(buffer).decode('utf-8')
+        img = decode_image(frame_data)
+        if img is None:
+            ws.send(json.dumps({'error': 'Ошибка декодирования кадра'}, ensure_ascii=False))
+            continue
+        detected_objects, reference = gate.reuse(gate_view(img, roi)) if gate is not None else (None, None)
+        if detected_objects is not None:
+            skipped_metric.inc('stream')
+        else:
+            try:
+                detected_objects = run_inference([img], conf_threshold, tiled=tiled, roi=roi)[0]
+            except InferenceQueueFull:
+                dropped += 1
+                continue
+            except Exception as e:
+                record_error(e)
+                ws.send(json.dumps({'error': f'Ошибка обработки: {str(e)}'}, ensure_ascii=False))
+                continue
+            if gate is not None:
+                gate.remember(detected_objects, reference)
         
-        return jsonify({
-            'success': True,
-            'luggage_count': luggage_count,
+        processed += 1
+        elapsed = time.monotonic() - started
+        message = {
+            'frame': processed,
+            'width': img.shape[1],
+            'height': img.shape[0],
+            'luggage_count': len(detected_objects),
             'detected_objects': detected_objects,
-            'result_image': f"data:image/jpeg;base64,{img_base64}",
-            'history_id': history_entry['id']
-        })
-    
-    return jsonify({'error': 'Неподдерживаемый формат файла'}), 400
+            'fps': round(processed / max(elapsed, 1e-6), 2),
+            'dropped': dropped,
+            'inference_skipped': gate.skipped if gate is not None else 0
+        }
+        if tracker is not None:
+            tracker.update(detected_objects, (img.shape[1], img.shape[0]), elapsed)
+            message['tracking'] = tracker.summary()
+        ws.send(json.dumps(message, ensure_ascii=False))
+
+@app.route('/api/ready', methods=['GET'])
+def readiness():
+    """Проверка готовности: 200, когда модель загружена и прогрета, иначе 503.
+    Первый вызов запускает прогрев, если он еще не начат"""
+    start_model_warmup()
+    ready = model_ready()
+    status = {
+        'ready': ready,
+        'backend': INFERENCE_BACKEND,
+        'workers': INFERENCE_WORKERS,
+        'workers_ready': inference_pool.ready_workers() if inference_pool is not None else int(ready)
+    }
+    failure = None if ready else model_failure()
+    if failure:
+        status['error'] = failure
+    return jsonify(status), 200 if ready else 503
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Счетчики попаданий и промахов кэша результатов"""
+    return jsonify(result_cache.stats())
+
+@app.route('/results/<path:filename>', methods=['GET'])
+def get_result_file(filename):
+    """Выдача сохраненного результата обработки (бинарный файл с заголовками кэширования)"""
+    response = send_from_directory(RESULTS_FOLDER, filename, max_age=RESULT_CACHE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/api/history', methods=['GET'])
 def get_history():
-    """Получение истории запросов"""
-    history = load_history()
-    return jsonify(history)
+    """Получение истории запросов: страницы от новых к старым, фильтры по времени и классу"""
+    since = request.args.get('since')
+    until = request.args.get('until')
+    object_class = request.args.get('class')
+    if not valid_report_range(since, until):
+        return jsonify({'error': 'Неверный формат since или until (ожидается ISO дата или время)'}), 400
+    
+    # Потоковая выдача всех подходящих записей в формате NDJSON
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for entry in history_store.iter_entries(since, until, object_class, newest_first=True):
+                yield json.dumps(entry, ensure_ascii=False) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({'error': 'Неверные параметры limit или cursor'}), 400
+    if limit < 1:
+        return jsonify({'error': 'Неверные параметры limit или cursor'}), 400
+    
+    items, next_cursor = history_store.page(limit, cursor, since, until, object_class)
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 @app.route('/api/history/<history_id>', methods=['GET'])
 def get_history_item(history_id):
     """Получение конкретной записи из истории"""
-    history = load_history()
-    for entry in history:
-        if entry['id'] == history_id:
-            return jsonify(entry)
-    return jsonify({'error': 'Запись не найдена'}), 404
+    entry = history_store.get(history_id)
+    if entry is None:
+        return jsonify({'error': 'Запись не найдена'}), 404
+    return jsonify(entry)
+
+@app.route('/api/history/<history_id>/image', methods=['GET'])
+def get_history_image(history_id):
+    """Аннотированное изображение записи: рисуется по исходнику и рамкам из истории,
+    без исходника (удален очисткой или не сохранялся) - миниатюра или сохраненный результат"""
+    entry = history_store.get(history_id)
+    if entry is None:
+        return jsonify({'error': 'Запись не найдена'}), 404
+    
+    original = entry.get('original')
+    if original and entry.get('media_type') != 'video':
+        if not media_store.exists(original):
+            wait_pending_writes()  # Исходник только что загружен и еще пишется в фоне
+        img = cv2.imread(media_store.path(original)) if media_store.exists(original) else None
+        if img is not None:
+            response = Response(encode_result_image(draw_detections(img, entry['detected_objects'])),
+                                mimetype='image/jpeg')
+            response.cache_control.max_age = RESULT_CACHE_MAX_AGE
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+    
+    for key in ('thumbnail_path', 'result_path'):
+        path = entry.get(key)
+        if path and key == 'thumbnail_path' and not os.path.exists(path):
+            wait_pending_writes()
+        if path and os.path.exists(path):
+            return send_file(os.path.abspath(path))
+    return jsonify({'error': 'Изображение удалено'}), 404
+
+@app.route('/api/cameras/roi', methods=['GET'])
+def get_camera_rois():
+    """ROI всех камер"""
+    return jsonify(roi_config.all())
+
+@app.route('/api/cameras/<source>/roi', methods=['GET', 'PUT', 'DELETE'])
+def camera_roi(source):
+    """ROI камеры: координаты - доли кадра, {"rect": [x1, y1, x2, y2]} или {"polygon": [[x, y], ...]}"""
+    if request.method == 'GET':
+        roi = roi_config.get(source)
+        if roi is None:
+            return jsonify({'error': 'ROI для камеры не задана'}), 404
+        return jsonify(roi)
+    if request.method == 'DELETE':
+        if not roi_config.delete(source):
+            return jsonify({'error': 'ROI для камеры не задана'}), 404
+        return jsonify({'success': True})
+    
+    try:
+        roi = roi_config.set(source, request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(roi)
+
+@app.route('/api/storage/stats', methods=['GET'])
+def get_storage_stats():
+    """Занятое место и результаты последней очистки хранилища"""
+    return jsonify(storage_stats)
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """Накопительная статистика; buckets=hour|day добавляет итоги по часам или дням (since/until)"""
+    stats = history_store.stats()
+    granularity = request.args.get('buckets')
+    if granularity:
+        if granularity not in ('hour', 'day'):
+            return jsonify({'error': 'Параметр buckets должен быть hour или day'}), 400
+        stats['buckets'] = history_store.buckets(granularity, request.args.get('since'), request.args.get('until'))
+    return jsonify(stats)
 
 @app.route('/api/generate-report', methods=['POST'])
 def generate_report():
@@ -198,137 +1017,368 @@ def generate_report():
             return jsonify({'error': 'Неверный формат данных'}), 400
         
         report_type = data.get('type', 'pdf')
+        since, until = data.get('since'), data.get('until')
+        if not valid_report_range(since, until):
+            return jsonify({'error': 'Неверный формат since/until (ожидается ISO дата)'}), 400
         
-        history = load_history()
-        if not history:
+        if history_store.count() == 0:
             return jsonify({'error': 'История пуста'}), 400
         
         if report_type == 'pdf':
-            return generate_pdf_report(history)
+            return generate_pdf_report(since, until)
         elif report_type == 'excel':
-            return generate_excel_report(history)
+            return generate_excel_report(since, until)
+        elif report_type == 'csv':
+            return generate_csv_report(since, until)
         else:
             return jsonify({'error': 'Неподдерживаемый тип отчета'}), 400
     except Exception as e:
         return jsonify({'error': f'Ошибка генерации отчета: {str(e)}'}), 500
 
-def generate_pdf_report(history):
-    """Генерация PDF отчета"""
+def run_image_job(filename, unique_filename, data, conf_threshold, tiled=False, roi=None):
+    """Фоновая обработка изображения (задача уже принята в очередь заданий, поэтому ждет места в очереди инференса)"""
+    detection = detect_image_bytes(data, conf_threshold, tiled, roi=roi, wait=True)
+    if detection is None:
+        raise ValueError('Ошибка загрузки изображения')
+    original = persist_upload(filename, data)
+    detected_objects, image_bytes, cached, _ = detection
+    response = store_image_result(filename, unique_filename, image_bytes, detected_objects, include_image=False,
+                                  original=original)
+    response['cached'] = cached
+    return response
+
+def run_video_job(filepath, filename, unique_filename, conf_threshold, track=False, tiled=False,
+                  gating=FRAME_GATING, roi=None):
+    """Фоновая обработка видео; результат - итог и аннотированное видео для скачивания"""
+    summary = None
+    for message in process_video_upload(filepath, filename, unique_filename, conf_threshold, track, tiled, gating,
+                                        roi):
+        summary = message
+    if summary is None or 'error' in summary:
+        raise ValueError(summary['error'] if summary else 'Видео не содержит кадров')
+    summary['file'] = os.path.join(RESULTS_FOLDER, os.path.basename(summary['result_video']))
+    return summary
+
+def run_report_job(report_type, since=None, until=None):
+    """Фоновая генерация отчета"""
+    if history_store.count() == 0:
+        raise ValueError('История пуста')
+    build_report = build_pdf_report if report_type == 'pdf' else build_excel_report
+    filepath, filename = build_report(since, until)
+    return {'file': filepath, 'filename': filename}
+
+def job_response(job):
+    """Статус задачи для клиента (без внутренних путей к файлам)"""
+    result = job['result']
+    if result is not None:
+        result = {k: v for k, v in result.items() if k != 'file'}
+    job = dict(job, result=result)
+    if job['status'] == 'done':
+        job['result_url'] = f"/api/jobs/{job['id']}/result"
+    return job
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_process_job():
+    """Постановка обработки изображения или видео в очередь; сразу возвращает id задачи"""
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'Файл не найден'}), 400
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'Неподдерживаемый формат файла'}), 400
+    
+    filename = secure_filename(file.filename)
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    conf_threshold = request_conf_threshold()
+    
+    if is_video_file(file.filename):
+        filepath = persist_video_upload(file, unique_filename)
+        job_id = job_manager.submit('video', run_video_job, filepath, filename, unique_filename, conf_threshold,
+                                    request_tracking(), request_tiled(), request_gating(), request_roi())
+    else:
+        job_id = job_manager.submit('image', run_image_job, filename, unique_filename, file.read(), conf_threshold,
+                                    request_tiled(), request_roi())
+    
+    return jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@app.route('/api/jobs/report', methods=['POST'])
+def submit_report_job():
+    """Постановка генерации отчета в очередь"""
+    data = request.get_json(silent=True) or {}
+    report_type = data.get('type', 'pdf')
+    if report_type not in ('pdf', 'excel'):
+        return jsonify({'error': 'Неподдерживаемый тип отчета'}), 400
+    since, until = data.get('since'), data.get('until')
+    if not valid_report_range(since, until):
+        return jsonify({'error': 'Неверный формат since/until (ожидается ISO дата)'}), 400
+    
+    job_id = job_manager.submit('report', run_report_job, report_type, since, until)
+    return jsonify({'job_id': job_id, 'status_url': f'/api/jobs/{job_id}'}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Статус задачи"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Результат завершенной задачи: файл (отчет, видео) или JSON"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if job['status'] == 'error':
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != 'done':
+        return jsonify({'error': 'Задача еще выполняется', 'status': job['status']}), 409
+    
+    result = job['result']
+    if 'file' in result:
+        return send_file(result['file'], as_attachment=True,
+                         download_name=result.get('filename', os.path.basename(result['file'])))
+    return jsonify(result)
+
+def valid_report_range(since, until):
+    """Границы периода отчета - ISO дата или время (или не заданы)"""
     try:
-        filename = f"luggage_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        filepath = os.path.join(RESULTS_FOLDER, filename)
-        
-        doc = SimpleDocTemplate(filepath, pagesize=A4)
-        story = []
+        for value in (since, until):
+            if value:
+                datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+def report_period_name(since, until):
+    return secure_filename(f"{since or 'start'}_{until or 'now'}")
+
+def cleanup_reports():
+    """Удаление отчетов старше REPORT_MAX_AGE и самых старых сверх REPORT_MAX_FILES"""
+    now = datetime.now().timestamp()
+    reports = []
+    for name in os.listdir(REPORTS_FOLDER):
+        if name.endswith('.tmp'):  # Отчет еще строится
+            continue
+        path = os.path.join(REPORTS_FOLDER, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if now - mtime > REPORT_MAX_AGE:
+            remove_report(path)
+        else:
+            reports.append((mtime, path))
+    reports.sort(reverse=True)
+    for _, path in reports[REPORT_MAX_FILES:]:
+        remove_report(path)
+
+def remove_report(path):
+    """Удаление отчета; файл мог уже удалить параллельный запрос"""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+pdf_styles = None
+
+def get_pdf_styles():
+    """Стили PDF отчета создаются один раз и переиспользуются"""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.platypus import TableStyle
+
+    global pdf_styles
+    if pdf_styles is None:
         styles = getSampleStyleSheet()
+        pdf_styles = {
+            'title': ParagraphStyle(
+                'CustomTitle',
+                parent=styles['Heading1'],
+                fontSize=24,
+                textColor=colors.HexColor('#1a1a1a'),
+                spaceAfter=30
+            ),
+            'heading': styles['Heading2'],
+            'normal': styles['Normal'],
+            'table': TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('FONTSIZE', (0, 0), (-1, 0), 14),
+                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+                ('GRID', (0, 0), (-1, -1), 1, colors.black)
+            ])
+        }
+    return pdf_styles
+
+def report_stats(since=None, until=None):
+    """Итоги для отчета: за все время или за период (почасовые корзины и точный подсчет на краях)"""
+    if not since and not until:
+        return history_store.stats()
+    total_requests, total_luggage = history_store.totals(since, until)
+    return {
+        'total_requests': total_requests,
+        'total_luggage': total_luggage,
+        'avg_luggage': total_luggage / total_requests if total_requests > 0 else 0
+    }
+
+def build_pdf_report(since=None, until=None):
+    """Генерация PDF отчета; возвращает путь к файлу и имя файла.
+    Отчет кэшируется по версии истории и периоду: пока история не изменилась, файл переиспользуется"""
+    filename = f"luggage_report_v{history_store.version()}_{report_period_name(since, until)}.pdf"
+    filepath = os.path.join(REPORTS_FOLDER, filename)
+    if os.path.exists(filepath):
+        os.utime(filepath)  # Недавно запрошенный отчет вытесняется последним
+        return filepath, filename
     
-        # Заголовок
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=24,
-            textColor=colors.HexColor('#1a1a1a'),
-            spaceAfter=30
-        )
-        story.append(Paragraph("Отчет по подсчету багажа", title_style))
-        story.append(Spacer(1, 0.2*inch))
-        
-        # Общая статистика
-        total_requests = len(history)
-        total_luggage = sum(entry.get('luggage_count', 0) for entry in history)
-        avg_luggage = total_luggage / total_requests if total_requests > 0 else 0
-        
-        stats_data = [
-            ['Параметр', 'Значение'],
-            ['Всего запросов', str(total_requests)],
-            ['Всего обнаружено багажа', str(total_luggage)],
-            ['Среднее количество на запрос', f"{avg_luggage:.2f}"]
-        ]
-        
-        stats_table = Table(stats_data, colWidths=[3*inch, 2*inch])
-        stats_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 14),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        
-        story.append(Paragraph("Общая статистика", styles['Heading2']))
-        story.append(Spacer(1, 0.1*inch))
-        story.append(stats_table)
-        story.append(Spacer(1, 0.3*inch))
-        
-        # Детальная история
-        story.append(Paragraph("Детальная история", styles['Heading2']))
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+
+    tmp_path = f"{filepath}.{uuid.uuid4().hex}.tmp"
+    doc = SimpleDocTemplate(tmp_path, pagesize=A4)
+    story = []
+    styles = get_pdf_styles()
+
+    # Заголовок
+    story.append(Paragraph("Отчет по подсчету багажа", styles['title']))
+    if since or until:
+        story.append(Paragraph(f"Период: {since or '...'} - {until or '...'}", styles['normal']))
+    story.append(Spacer(1, 0.2*inch))
+    
+    # Общая статистика (накопительные итоги, без обхода истории)
+    stats = report_stats(since, until)
+    
+    stats_data = [
+        ['Параметр', 'Значение'],
+        ['Всего запросов', str(stats['total_requests'])],
+        ['Всего обнаружено багажа', str(stats['total_luggage'])],
+        ['Среднее количество на запрос', f"{stats['avg_luggage']:.2f}"]
+    ]
+    
+    stats_table = Table(stats_data, colWidths=[3*inch, 2*inch])
+    stats_table.setStyle(styles['table'])
+    
+    story.append(Paragraph("Общая статистика", styles['heading']))
+    story.append(Spacer(1, 0.1*inch))
+    story.append(stats_table)
+    story.append(Spacer(1, 0.3*inch))
+    
+    # Детальная история
+    story.append(Paragraph("Детальная история", styles['heading']))
+    story.append(Spacer(1, 0.1*inch))
+    
+    recent_entries, _ = history_store.page(10, since=since, until=until)
+    for entry in reversed(recent_entries):  # Последние 10 записей
+        timestamp = datetime.fromisoformat(entry['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
+        story.append(Paragraph(f"<b>Запрос от {timestamp}</b>", styles['normal']))
+        story.append(Paragraph(f"Файл: {entry['filename']}", styles['normal']))
+        story.append(Paragraph(f"Обнаружено багажа: {entry['luggage_count']}", styles['normal']))
         story.append(Spacer(1, 0.1*inch))
-        
-        for entry in history[-10:]:  # Последние 10 записей
-            timestamp = datetime.fromisoformat(entry['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
-            story.append(Paragraph(f"<b>Запрос от {timestamp}</b>", styles['Normal']))
-            story.append(Paragraph(f"Файл: {entry['filename']}", styles['Normal']))
-            story.append(Paragraph(f"Обнаружено багажа: {entry['luggage_count']}", styles['Normal']))
-            story.append(Spacer(1, 0.1*inch))
-        
-        doc.build(story)
-        
+    
+    doc.build(story)
+    os.replace(tmp_path, filepath)
+    cleanup_reports()
+    
+    return filepath, filename
+
+def generate_pdf_report(since=None, until=None):
+    """Генерация PDF отчета"""
+    try:
+        filepath, filename = build_pdf_report(since, until)
         return send_file(filepath, as_attachment=True, download_name=filename)
     except Exception as e:
         from flask import jsonify
         return jsonify({'error': f'Ошибка генерации PDF: {str(e)}'}), 500
 
-def generate_excel_report(history):
-    """Генерация Excel отчета"""
+def iter_report_rows(since=None, until=None):
+    """Строки табличного отчета и итоговая строка: один проход по истории без загрузки ее в память"""
+    total_requests = 0
+    total_luggage = 0
+    for entry in history_store.iter_entries(since, until):
+        total_requests += 1
+        total_luggage += entry['luggage_count']
+        yield [
+            datetime.fromisoformat(entry['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
+            entry['filename'],
+            entry['luggage_count'],
+            ', '.join([obj['class'] for obj in entry.get('detected_objects', [])])
+        ]
+    yield ['ИТОГО', '', total_luggage, f"Всего запросов: {total_requests}"]
+
+def write_excel_report(fileobj, since=None, until=None):
+    """Потоковая запись Excel отчета (openpyxl write_only: строки не накапливаются в памяти).
+    Сверх EXCEL_MAX_ROWS строк отчет продолжается на листах 'Отчет 2', 'Отчет 3', ...;
+    итоговая строка оказывается на последнем листе"""
+    from openpyxl import Workbook
+    from openpyxl.utils import get_column_letter
+
+    workbook = Workbook(write_only=True)
+
+    def add_sheet(number):
+        worksheet = workbook.create_sheet('Отчет' if number == 1 else f'Отчет {number}')
+        for index, (_, width) in enumerate(REPORT_COLUMNS, start=1):
+            worksheet.column_dimensions[get_column_letter(index)].width = width
+        worksheet.append([title for title, _ in REPORT_COLUMNS])
+        return worksheet
+
+    sheet_number = 1
+    worksheet = add_sheet(sheet_number)
+    sheet_rows = 1
+    for row in iter_report_rows(since, until):
+        if sheet_rows == EXCEL_MAX_ROWS:
+            sheet_number += 1
+            worksheet = add_sheet(sheet_number)
+            sheet_rows = 1
+        worksheet.append(row)
+        sheet_rows += 1
+    workbook.save(fileobj)
+
+def build_excel_report(since=None, until=None):
+    """Генерация Excel отчета; возвращает путь к файлу и имя файла"""
+    filename = f"luggage_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    filepath = os.path.join(REPORTS_FOLDER, filename)
+    write_excel_report(filepath, since, until)
+    cleanup_reports()
+    return filepath, filename
+
+def generate_excel_report(since=None, until=None):
+    """Генерация Excel отчета (во временный файл ОС, без сохранения в RESULTS_FOLDER)"""
     try:
         filename = f"luggage_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filepath = os.path.join(RESULTS_FOLDER, filename)
-        
-        # Подготовка данных
-        data = []
-        for entry in history:
-            data.append({
-                'Дата и время': datetime.fromisoformat(entry['timestamp']).strftime('%Y-%m-%d %H:%M:%S'),
-                'Файл': entry['filename'],
-                'Количество багажа': entry['luggage_count'],
-                'Объекты': ', '.join([obj['class'] for obj in entry.get('detected_objects', [])])
-            })
-        
-        df = pd.DataFrame(data)
-        
-        # Добавление итоговой строки
-        total_row = pd.DataFrame([{
-            'Дата и время': 'ИТОГО',
-            'Файл': '',
-            'Количество багажа': df['Количество багажа'].sum(),
-            'Объекты': f"Всего запросов: {len(df)}"
-        }])
-        df = pd.concat([df, total_row], ignore_index=True)
-        
-        # Сохранение в Excel
-        with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Отчет', index=False)
-            
-            # Форматирование
-            worksheet = writer.sheets['Отчет']
-            for column in worksheet.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column_letter].width = adjusted_width
-        
-        return send_file(filepath, as_attachment=True, download_name=filename)
+        report_file = tempfile.TemporaryFile()
+        write_excel_report(report_file, since, until)
+        report_file.seek(0)
+        return send_file(report_file, as_attachment=True, download_name=filename,
+                         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     except Exception as e:
         from flask import jsonify
         return jsonify({'error': f'Ошибка генерации Excel: {str(e)}'}), 500
 
+def generate_csv_report(since=None, until=None):
+    """Потоковая выдача CSV отчета фрагментами, без файла на диске"""
+    filename = f"luggage_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write('\ufeff')  # BOM, чтобы Excel распознал UTF-8
+        writer.writerow([title for title, _ in REPORT_COLUMNS])
+        for index, row in enumerate(iter_report_rows(since, until), start=1):
+            writer.writerow(row)
+            if index % REPORT_CSV_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        yield buffer.getvalue()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # Модель загружается и прогревается в фоне, пока сервер уже принимает запросы (готовность - /api/ready)
+    start_model_warmup()
+    # Без debug: перезагрузчик запускал бы пул воркеров дважды
+    app.run(host='0.0.0.0', port=5001, threaded=True)
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Бенчмарк инференса на изображениях из uploads/: задержка по этапам,
+пропускная способность при разных батчах и параллелизме, пиковая память.
+Результат сохраняется в JSON для сравнения моделей, бэкендов и поиска регрессий.
+
+Пример: python benchmark.py --backend openvino --batch-sizes 1,4,8 --concurrency 1,2,4
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from detector import (LuggageDetector, draw_detections, export_model, extract_luggage_objects,
+                      CONFIDENCE_THRESHOLD, IMAGE_SIZE, MODEL_PATH)
+from history_store import HistoryStore
+from inference_pool import InferencePool
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '_jpg', '_png', '_jpeg')
+WORKERS_READY_TIMEOUT = 600  # Предельное ожидание загрузки модели воркерами пула (секунды)
+
+
+def load_corpus(folder):
+    """Байты всех изображений каталога, включая подкаталоги (uploads/ раскладывается по первым
+    символам хэша); имена из secure_filename бывают без точки"""
+    corpus = []
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(dirpath, name), 'rb') as f:
+                    corpus.append((os.path.relpath(os.path.join(dirpath, name), folder), f.read()))
+    return corpus
+
+
+def summarize(samples):
+    """Статистика задержек в миллисекундах"""
+    ordered = sorted(samples)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.mean(ordered) * 1000, 3),
+        'p50_ms': round(percentile(50) * 1000, 3),
+        'p95_ms': round(percentile(95) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3)
+    }
+
+
+def peak_memory_mb():
+    """Пиковый RSS текущего процесса и дочерних процессов (воркеров пула)"""
+    if resource is None:
+        return None
+    scale = 1024 * 1024 if platform.system() == 'Darwin' else 1024  # ru_maxrss: байты на macOS, КБ в Linux
+    self_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return {'self_mb': round(self_peak, 1), 'children_mb': round(children_peak, 1)}
+
+
+def bench_stages(detector, corpus, repeats, conf_threshold):
+    """Задержка каждого этапа обработки одного изображения, как в /api/process"""
+    stages = {name: [] for name in ('decode', 'inference', 'postprocess', 'draw', 'encode', 'history_write')}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        store = HistoryStore(os.path.join(tmp_dir, 'history.db'))
+        for _ in range(repeats):
+            for name, data in corpus:
+                start = time.perf_counter()
+                img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+                stages['decode'].append(time.perf_counter() - start)
+                if img is None:
+                    continue
+
+                start = time.perf_counter()
+                result = detector.model([img], imgsz=detector.imgsz, conf=conf_threshold, verbose=False)[0]
+                stages['inference'].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                detected_objects = extract_luggage_objects(result, detector.class_mask, conf_threshold)
+                stages['postprocess'].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                draw_detections(img, detected_objects)
+                stages['draw'].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                cv2.imencode('.jpg', img)
+                stages['encode'].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                store.append({
+                    'id': str(uuid.uuid4()),
+                    'timestamp': datetime.now().isoformat(),
+                    'filename': name,
+                    'luggage_count': len(detected_objects),
+                    'detected_objects': detected_objects
+                })
+                stages['history_write'].append(time.perf_counter() - start)
+    return {name: summarize(samples) for name, samples in stages.items() if samples}
+
+
+def bench_batches(detector, images, batch_sizes, repeats, conf_threshold):
+    """Пропускная способность модели в текущем процессе при разных размерах батча"""
+    results = []
+    for batch_size in batch_sizes:
+        batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+        detector.warmup((batch_size,))
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for batch in batches:
+                batch_start = time.perf_counter()
+                detector.detect(batch, conf_threshold)
+                latencies.append(time.perf_counter() - batch_start)
+        elapsed = time.perf_counter() - start
+        results.append({
+            'batch_size': batch_size,
+            'images_per_sec': round(len(images) * repeats / elapsed, 2),
+            'batch_latency': summarize(latencies)
+        })
+    return results
+
+
+def bench_concurrency(model_file, images, levels, repeats, max_batch, conf_threshold):
+    """Пропускная способность пула процессов: N воркеров и N параллельных клиентов"""
+    results = []
+    for level in levels:
+        pool = InferencePool(model_file, level, max_queue=max(64, level * max_batch),
+                             max_batch=max_batch, batch_timeout=0.01)
+        try:
+            deadline = time.monotonic() + WORKERS_READY_TIMEOUT
+            while pool.ready_workers() < level:
+                if pool.failure() or time.monotonic() > deadline:
+                    raise RuntimeError(pool.failure() or f'Воркеры пула не загрузили модель за {WORKERS_READY_TIMEOUT} с')
+                time.sleep(0.1)
+            latencies = []
+
+            def client(client_images):
+                for img in client_images:
+                    request_start = time.perf_counter()
+                    pool.infer([img], conf_threshold, wait=True)
+                    latencies.append(time.perf_counter() - request_start)
+
+            workload = images * repeats
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as executor:
+                list(executor.map(client, [workload[i::level] for i in range(level)]))
+            elapsed = time.perf_counter() - start
+        finally:
+            pool.shutdown()
+        results.append({
+            'concurrency': level,
+            'images_per_sec': round(len(workload) / elapsed, 2),
+            'request_latency': summarize(latencies)
+        })
+    return results
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк детекции багажа на изображениях из uploads/')
+    parser.add_argument('--images', default='uploads', help='Каталог с изображениями')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--backend', default=os.environ.get('INFERENCE_BACKEND', 'torch'),
+                        help='torch, onnx или openvino')
+    parser.add_argument('--half', action='store_true', help='Экспорт модели в FP16')
+    parser.add_argument('--batch-sizes', type=parse_int_list, default=[1, 4, 8])
+    parser.add_argument('--concurrency', type=parse_int_list, default=[1, 2, 4],
+                        help='Число воркеров пула и параллельных клиентов (пусто - пропустить)')
+    parser.add_argument('--repeats', type=int, default=3, help='Сколько раз прогнать весь набор')
+    parser.add_argument('--conf', type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images)
+    if not corpus:
+        parser.error(f"В каталоге {args.images} нет изображений")
+    images = [img for img in (cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) for _, data in corpus)
+              if img is not None]
+
+    model_file = export_model(args.model, args.backend, args.half)
+    load_start = time.perf_counter()
+    detector = LuggageDetector(model_file)
+    load_seconds = time.perf_counter() - load_start
+    warmup_start = time.perf_counter()
+    detector.warmup()
+    warmup_seconds = time.perf_counter() - warmup_start
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'model': args.model,
+        'model_file': model_file,
+        'backend': args.backend,
+        'half': args.half,
+        'image_size': IMAGE_SIZE,
+        'images': len(images),
+        'repeats': args.repeats,
+        'platform': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+        'model_load_seconds': round(load_seconds, 3),
+        'warmup_seconds': round(warmup_seconds, 3),
+        'stages': bench_stages(detector, corpus, args.repeats, args.conf),
+        'batches': bench_batches(detector, images, args.batch_sizes, args.repeats, args.conf)
+    }
+    report['peak_memory_in_process'] = peak_memory_mb()
+    if args.concurrency:
+        report['concurrency'] = bench_concurrency(model_file, images, args.concurrency, args.repeats,
+                                                  max(args.batch_sizes), args.conf)
+    report['peak_memory'] = peak_memory_mb()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты бенчмарка сохранены: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Пакетная обработка каталога изображений и видео без веб-сервера.
+Файлы обрабатываются параллельно через пул процессов инференса (с динамическими батчами),
+результаты пишутся в JSONL или Parquet по одной записи на файл. При повторном запуске
+файлы, уже успешно записанные в выходной файл, пропускаются; файлы с ошибкой обрабатываются
+заново (в выводе появляется новая запись для того же пути).
+
+Пример: python bulk_process.py /data/archive --output detections.jsonl --history history.db
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import cv2
+
+from detector import (export_model, CONFIDENCE_THRESHOLD, INFERENCE_BATCH_TIMEOUT, INFERENCE_MAX_BATCH,
+                      INFERENCE_TIMEOUT, MODEL_PATH)
+from history_store import HistoryStore
+from inference_pool import InferencePool
+from video_processing import (create_frame_gate, create_tracker, iter_video_detections, IMAGE_EXTENSIONS,
+                              VIDEO_EXTENSIONS, VIDEO_BATCH_SIZE)
+
+DEFAULT_OUTPUTS = {'jsonl': 'detections.jsonl', 'parquet': 'detections_parquet'}
+
+
+def media_type(path):
+    extension = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    if extension in IMAGE_EXTENSIONS:
+        return 'image'
+    if extension in VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+
+def iter_media_files(root):
+    """Изображения и видео каталога (рекурсивно, в стабильном порядке): пути относительно root"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.relpath(os.path.join(dirpath, name), root)
+            if media_type(path):
+                yield path
+
+
+class JsonlSink:
+    """Выходной JSONL-файл: дозапись по одной строке на файл"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def processed_paths(self):
+        """Файлы, успешно обработанные при прошлых запусках (записи с ошибкой и оборванная
+        последняя строка не учитываются)"""
+        if not os.path.exists(self.path):
+            return set()
+        paths = set()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if 'error' not in record:
+                        paths.add(record['path'])
+                except (ValueError, KeyError):
+                    continue
+        return paths
+
+    def write(self, records):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ParquetSink:
+    """Каталог Parquet: каждая порция записей - отдельный файл part-NNNNN.parquet"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit('Для вывода в Parquet нужен pyarrow: pip install pyarrow')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self):
+        return sorted(name for name in os.listdir(self.path) if name.startswith('part-') and name.endswith('.parquet'))
+
+    def processed_paths(self):
+        """Файлы, успешно обработанные при прошлых запусках (записи с ошибкой не учитываются)"""
+        paths = set()
+        for name in self._parts():
+            table = self.pq.read_table(os.path.join(self.path, name), columns=['path', 'error'])
+            paths.update(path for path, error in zip(table.column('path').to_pylist(), table.column('error').to_pylist())
+                         if error is None)
+        return paths
+
+    def write(self, records):
+        # Вложенные структуры хранятся JSON-строками: схема одинакова для изображений и видео
+        columns = {}
+        for key in ('path', 'media_type', 'processed_at', 'luggage_count', 'frames_processed', 'inference_skipped'):
+            columns[key] = [record.get(key) for record in records]
+        for key in ('detected_objects', 'frame_counts', 'tracking', 'error'):
+            columns[key] = [json.dumps(record[key], ensure_ascii=False) if key in record else None for record in records]
+        table = self.pa.table(columns)
+        part_path = os.path.join(self.path, f"part-{len(self._parts()):05d}.parquet")
+        tmp_path = f"{part_path}.tmp"
+        self.pq.write_table(table, tmp_path)
+        os.replace(tmp_path, part_path)
+
+
+def process_image(pool, path, conf_threshold):
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError('Ошибка загрузки изображения')
+    detected_objects = pool.infer([img], conf_threshold, wait=True, timeout=INFERENCE_TIMEOUT)[0]
+    return {'luggage_count': len(detected_objects), 'detected_objects': detected_objects}
+
+
+def process_video(pool, path, conf_threshold, track=False, gating=True):
+    """Видео: число багажа по кадрам, кадр с максимумом багажа, при track - число уникального багажа"""
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError('Ошибка открытия видео')
+    fps = capture.get(cv2.CAP_PROP_FPS) or 25
+    tracker = create_tracker() if track else None
+    gate = create_frame_gate() if gating else None
+
+    def infer(frames):
+        return pool.infer(frames, conf_threshold, wait=True, timeout=INFERENCE_TIMEOUT)
+
+    frame_counts = []
+    peak_objects = []
+    try:
+        for _, _, detected_objects, _, _ in iter_video_detections(
+                capture, infer, VIDEO_BATCH_SIZE, fps, gate.changed if gate is not None else None, tracker):
+            frame_counts.append(len(detected_objects))
+            if len(detected_objects) > len(peak_objects):
+                peak_objects = detected_objects
+    finally:
+        capture.release()
+
+    result = {
+        'frames_processed': len(frame_counts),
+        'luggage_count': tracker.line_crossings if tracker else len(peak_objects),
+        'detected_objects': peak_objects,
+        'frame_counts': frame_counts,
+        'inference_skipped': gate.skipped if gate is not None else 0
+    }
+    if tracker is not None:
+        result['tracking'] = tracker.summary()
+    return result
+
+
+def process_file(pool, root, path, args):
+    """Запись для одного файла; ошибка обработки сохраняется в записи, а не прерывает весь прогон"""
+    record = {'path': path, 'media_type': media_type(path)}
+    full_path = os.path.join(root, path)
+    try:
+        if record['media_type'] == 'video':
+            record.update(process_video(pool, full_path, args.conf, args.track, not args.no_gate))
+        else:
+            record.update(process_image(pool, full_path, args.conf))
+    except Exception as e:
+        record['error'] = str(e)
+    record['processed_at'] = datetime.now().isoformat()
+    return record
+
+
+def history_entry(root, record):
+    """Запись истории в том же формате, что и у веб-сервера"""
+    entry = {
+        'id': str(uuid.uuid4()),
+        'timestamp': record['processed_at'],
+        'filename': os.path.basename(record['path']),
+        'source_path': os.path.join(root, record['path']),
+        'luggage_count': record['luggage_count'],
+        'detected_objects': record['detected_objects']
+    }
+    if record['media_type'] == 'video':
+        entry['media_type'] = 'video'
+        entry['frames_processed'] = record['frames_processed']
+        if 'tracking' in record:
+            entry['tracking'] = record['tracking']
+    return entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Пакетная обработка каталога изображений и видео')
+    parser.add_argument('input', help='Каталог с файлами (обходится рекурсивно)')
+    parser.add_argument('--output', help='JSONL-файл или каталог Parquet (для --format parquet); '
+                                          'по умолчанию detections.jsonl или detections_parquet')
+    parser.add_argument('--format', choices=('jsonl', 'parquet'), default='jsonl')
+    parser.add_argument('--history', help='Дописывать результаты в базу истории (например, history.db)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Процессы инференса')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='Файлы, обрабатываемые одновременно (по умолчанию 2 на воркер)')
+    parser.add_argument('--chunk-size', type=int, default=500, help='Записей в одной порции вывода')
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--backend', default=os.environ.get('INFERENCE_BACKEND', 'torch'),
+                        help='torch, onnx или openvino')
+    parser.add_argument('--conf', type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument('--track', action='store_true', help='Считать уникальный багаж в видео')
+    parser.add_argument('--no-gate', action='store_true', help='Не пропускать неизменившиеся кадры видео')
+    args = parser.parse_args()
+    args.output = args.output or DEFAULT_OUTPUTS[args.format]
+
+    sink = ParquetSink(args.output) if args.format == 'parquet' else JsonlSink(args.output)
+    done = sink.processed_paths()
+    pending = [path for path in iter_media_files(args.input) if path not in done]
+    print(f"Файлов к обработке: {len(pending)} (уже обработано: {len(done)})")
+    if not pending:
+        return
+
+    history_store = HistoryStore(args.history) if args.history else None
+    jobs = args.jobs or args.workers * 2
+    pool = InferencePool(export_model(args.model, args.backend), args.workers, max_queue=jobs * VIDEO_BATCH_SIZE,
+                         max_batch=INFERENCE_MAX_BATCH, batch_timeout=INFERENCE_BATCH_TIMEOUT)
+
+    records = []
+    completed = 0
+    started = time.monotonic()
+
+    def flush():
+        sink.write(records)
+        if history_store is not None:
+            history_store.append_many([history_entry(args.input, r) for r in records if 'error' not in r])
+        records.clear()
+
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    in_flight = set()
+    try:
+        files = iter(pending)
+        while True:
+            # Ограниченное окно задач: список файлов может быть очень большим
+            for path in files:
+                in_flight.add(executor.submit(process_file, pool, args.input, path, args))
+                if len(in_flight) >= jobs * 2:
+                    break
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                records.append(future.result())
+                completed += 1
+            if len(records) >= args.chunk_size:
+                flush()
+                rate = completed / (time.monotonic() - started)
+                print(f"Обработано {completed}/{len(pending)} ({rate:.1f} файлов/с)")
+    finally:
+        # При прерывании (Ctrl+C) не начатые файлы отменяются, начатые дорабатываются: воркеры пула
+        # игнорируют SIGINT, а ожидание результата ограничено INFERENCE_TIMEOUT.
+        # Готовые записи сохраняются, при следующем запуске эти файлы пропускаются
+        executor.shutdown(wait=True, cancel_futures=True)
+        records.extend(future.result() for future in in_flight if not future.cancelled())
+        if records:
+            flush()
+        pool.shutdown()
+    print(f"Готово: {completed} файлов за {time.monotonic() - started:.1f} с, результат: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
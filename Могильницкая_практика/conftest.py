@@ -0,0 +1,3 @@
+"""
+Общая настройка pytest: модули проекта лежат рядом с этим файлом и импортируются тестами напрямую
+"""
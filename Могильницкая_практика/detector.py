@@ -0,0 +1,198 @@
+"""
+Детектирование багажа моделью YOLO: отбор классов багажа и отрисовка рамок
+"""
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+# Используем YOLOv8, которая хорошо детектирует объекты (включая сумки, чемоданы)
+MODEL_PATH = 'yolov8n.pt'  # nano версия для быстрой работы
+
+# Классы YOLO, связанные с багажом
+LUGGAGE_CLASSES = ['suitcase', 'handbag', 'backpack', 'bag', 'sports ball']
+LUGGAGE_CLASS_IDS = [24, 26, 27, 28, 32]  # ID классов в COCO dataset
+CONFIDENCE_THRESHOLD = 0.25  # Минимальная уверенность детекции (можно переопределить параметром conf)
+IMAGE_SIZE = 640  # Размер входа модели (экспортированные модели собираются под него)
+MODEL_CACHE_DIR = 'models'  # Каталог экспортированных моделей
+INFERENCE_MAX_BATCH = 8  # Максимальный размер динамического батча в воркере пула
+INFERENCE_BATCH_TIMEOUT = 0.01  # Сколько секунд воркер ждет дополнительные кадры в батч
+INFERENCE_TIMEOUT = 120  # Предельное ожидание результата одного вызова пула (секунды)
+
+# Бэкенды инференса: формат экспорта ultralytics и суффикс артефакта
+EXPORT_BACKENDS = {
+    'onnx': ('onnx', '.onnx'),  # ONNX Runtime
+    'openvino': ('openvino', '_openvino_model'),  # OpenVINO (каталог с IR-моделью)
+}
+
+
+def build_luggage_class_mask(names):
+    """Булева маска по ID класса: True для классов багажа"""
+    mask = np.zeros(max(names) + 1, dtype=bool)
+    for cls_id, name in names.items():
+        mask[cls_id] = cls_id in LUGGAGE_CLASS_IDS or name in LUGGAGE_CLASSES
+    return mask
+
+
+def extract_luggage_objects(result, class_mask, conf_threshold=CONFIDENCE_THRESHOLD):
+    """Отбор объектов багажа из результата YOLO для одного кадра"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return []
+
+    # Фильтрация сразу по всем рамкам: маска классов багажа и порог уверенности
+    cls_ids = boxes.cls.cpu().numpy().astype(int)
+    confs = boxes.conf.cpu().numpy()
+    keep = class_mask[cls_ids] & (confs >= conf_threshold)
+    if not keep.any():
+        return []
+
+    xyxy = boxes.xyxy.cpu().numpy()[keep].astype(int)
+    return [
+        {
+            'class': result.names[cls_id],
+            'confidence': round(float(conf), 2),
+            'bbox': bbox.tolist()
+        }
+        for cls_id, conf, bbox in zip(cls_ids[keep], confs[keep], xyxy)
+    ]
+
+
+def draw_detections(img, detected_objects):
+    """Рисуем bounding boxes на изображении (на месте)"""
+    for obj in detected_objects:
+        x1, y1, x2, y2 = obj['bbox']
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        label = f"{obj['class']} {obj['confidence']:.2f}"
+        cv2.putText(img, label, (x1, y1 - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return img
+
+
+def tile_offsets(length, tile_size, stride):
+    """Начала тайлов вдоль одной стороны кадра; последний тайл прижат к краю"""
+    if length <= tile_size:
+        return [0]
+    offsets = list(range(0, length - tile_size, stride))
+    offsets.append(length - tile_size)
+    return offsets
+
+
+def make_tiles(img, tile_size=IMAGE_SIZE, overlap=0.2):
+    """Разбиение кадра на перекрывающиеся тайлы: список (x, y, тайл).
+    overlap - доля перекрытия соседних тайлов"""
+    height, width = img.shape[:2]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    return [
+        (x, y, img[y:y + tile_size, x:x + tile_size])
+        for y in tile_offsets(height, tile_size, stride)
+        for x in tile_offsets(width, tile_size, stride)
+    ]
+
+
+def shift_detections(detected_objects, dx, dy):
+    """Перенос рамок из координат тайла в координаты кадра"""
+    return [
+        dict(obj, bbox=[obj['bbox'][0] + dx, obj['bbox'][1] + dy, obj['bbox'][2] + dx, obj['bbox'][3] + dy])
+        for obj in detected_objects
+    ]
+
+
+def merge_detections(detected_objects, overlap_threshold=0.5):
+    """NMS между тайлами отдельно по каждому классу. Перекрытие считается как
+    пересечение, деленное на площадь меньшей рамки: рамка, обрезанная краем тайла,
+    подавляется полной рамкой того же объекта из соседнего тайла"""
+    if len(detected_objects) < 2:
+        return detected_objects
+    boxes = np.array([obj['bbox'] for obj in detected_objects], dtype=float)
+    confs = np.array([obj['confidence'] for obj in detected_objects])
+    classes = np.array([obj['class'] for obj in detected_objects])
+    areas = np.maximum(boxes[:, 2] - boxes[:, 0], 1) * np.maximum(boxes[:, 3] - boxes[:, 1], 1)
+
+    # При равной уверенности предпочтение большей рамке
+    order = np.lexsort((-areas, -confs))
+    keep = []
+    suppressed = np.zeros(len(detected_objects), dtype=bool)
+    for i in order:
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        x1 = np.maximum(boxes[i, 0], boxes[:, 0])
+        y1 = np.maximum(boxes[i, 1], boxes[:, 1])
+        x2 = np.minimum(boxes[i, 2], boxes[:, 2])
+        y2 = np.minimum(boxes[i, 3], boxes[:, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        overlap = inter / np.minimum(areas[i], areas)
+        suppressed |= (classes == classes[i]) & (overlap >= overlap_threshold)
+    return [detected_objects[i] for i in sorted(keep)]
+
+
+def export_model(model_path=MODEL_PATH, backend='torch', half=False, imgsz=IMAGE_SIZE):
+    """Путь к модели для выбранного бэкенда. Экспорт выполняется один раз,
+    дальше используется сохраненный в MODEL_CACHE_DIR артефакт"""
+    if backend == 'torch':
+        return model_path
+    if backend not in EXPORT_BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд инференса: {backend}")
+    export_format, suffix = EXPORT_BACKENDS[backend]
+    if half and backend == 'onnx':
+        import torch
+
+        # Без GPU ultralytics молча экспортирует ONNX в FP32, а артефакт назывался бы fp16
+        if not torch.cuda.is_available():
+            raise ValueError("ONNX в FP16 экспортируется только на GPU: отключите FP16 или выберите openvino")
+
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    precision = 'fp16' if half else 'fp32'
+    cached_path = os.path.join(MODEL_CACHE_DIR, f"{stem}_{imgsz}_{precision}{suffix}")
+    if os.path.exists(cached_path):
+        return cached_path
+
+    from ultralytics import YOLO
+
+    # dynamic=True - модель принимает батчи разного размера (динамическое объединение в пуле)
+    exported_path = YOLO(model_path).export(format=export_format, imgsz=imgsz, half=half, dynamic=True)
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    shutil.move(str(exported_path), cached_path)
+    return cached_path
+
+
+class LuggageDetector:
+    """Модель YOLO с маской классов багажа (один экземпляр на процесс).
+    Принимает как .pt, так и экспортированные модели (ONNX, OpenVINO)"""
+
+    def __init__(self, model_path=MODEL_PATH, imgsz=IMAGE_SIZE):
+        # ultralytics (и torch) импортируются только там, где модель действительно нужна
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path, task='detect')
+        self.imgsz = imgsz
+        self.class_mask = build_luggage_class_mask(self.model.names)
+
+    def warmup(self, batch_sizes=(1,)):
+        """Прогон пустых кадров: инициализация графа и выделение памяти до первого запроса"""
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        for batch_size in batch_sizes:
+            self.model([dummy] * batch_size, imgsz=self.imgsz, verbose=False)
+
+    def detect(self, images, conf_thresholds=CONFIDENCE_THRESHOLD, timings=None):
+        """Детекции багажа для списка изображений одним вызовом модели.
+        Порог уверенности - общий или отдельный для каждого изображения.
+        В словарь timings (если передан) записывается длительность этапов в секундах"""
+        if not isinstance(conf_thresholds, (list, tuple)):
+            conf_thresholds = [conf_thresholds] * len(images)
+        start = time.perf_counter()
+        # Модель отсекает по наименьшему порогу (иначе действует ее собственный порог 0.25),
+        # точный порог каждого изображения применяется при разборе результатов
+        results = self.model(images, imgsz=self.imgsz, conf=min(conf_thresholds), verbose=False)
+        inference_done = time.perf_counter()
+        detections = [
+            extract_luggage_objects(result, self.class_mask, conf)
+            for result, conf in zip(results, conf_thresholds)
+        ]
+        if timings is not None:
+            timings['inference'] = inference_done - start
+            timings['postprocess'] = time.perf_counter() - inference_done
+        return detections
@@ -0,0 +1,77 @@
+"""
+Пропуск инференса для неизменившихся кадров (пустая или стоящая лента)
+"""
+import threading
+
+import cv2
+import numpy as np
+
+
+class FrameGate:
+    """Сравнение уменьшенного кадра в оттенках серого с кадром, на котором последний раз
+    работала модель. Если доля заметно изменившихся пикселей не больше change_ratio,
+    модель не вызывается и переиспользуются детекции опорного кадра. Сравнение идет
+    с опорным кадром, а не с предыдущим, поэтому медленные изменения накапливаются и не теряются"""
+
+    def __init__(self, pixel_delta=25, change_ratio=0.005, size=64, max_skips=150):
+        self.pixel_delta = pixel_delta  # Разница яркости (0-255), с которой пиксель считается изменившимся
+        self.change_ratio = change_ratio  # Доля изменившихся пикселей, начиная с которой кадр обрабатывается
+        self.size = size  # Сторона уменьшенного кадра для сравнения
+        self.max_skips = max_skips  # Принудительный инференс после стольких пропусков подряд
+        self.skipped = 0
+        self._reference = None
+        self._generation = 0  # Номер опорного кадра: детекции от устаревшего опорного кадра не сохраняются
+        self._detections = None
+        self._skips_in_row = 0
+        self._lock = threading.Lock()
+
+    def _signature(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        return cv2.resize(gray, (self.size, self.size), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def _similar(self, signature):
+        """Кадр почти не отличается от опорного (вызывается под блокировкой)"""
+        if self._reference is None or self._skips_in_row >= self.max_skips:
+            return False
+        changed_pixels = np.count_nonzero(np.abs(signature - self._reference) > self.pixel_delta)
+        return changed_pixels <= self.change_ratio * signature.size
+
+    def _set_reference(self, signature):
+        self._reference = signature
+        self._generation += 1
+        self._detections = None
+        self._skips_in_row = 0
+        return self._generation
+
+    def changed(self, img):
+        """Нужен ли инференс для кадра. При True кадр становится опорным.
+        Для видео: детекции пропущенных кадров вызывающий берет сам от последнего обработанного кадра"""
+        signature = self._signature(img)
+        with self._lock:
+            if self._similar(signature):
+                self._skips_in_row += 1
+                self.skipped += 1
+                return False
+            self._set_reference(signature)
+            return True
+
+    def reuse(self, img):
+        """Одна проверка под блокировкой для отдельных кадров (изображения, WebSocket):
+        (копия детекций опорного кадра, None), если кадр не изменился и детекции уже есть,
+        иначе (None, номер опорного кадра) - кадр становится опорным, после инференса
+        детекции передаются в remember с этим номером. Пропуск засчитывается, только когда
+        детекции действительно переиспользованы"""
+        signature = self._signature(img)
+        with self._lock:
+            if self._detections is not None and self._similar(signature):
+                self._skips_in_row += 1
+                self.skipped += 1
+                return [dict(obj) for obj in self._detections], None
+            return None, self._set_reference(signature)
+
+    def remember(self, detected_objects, reference):
+        """Сохранение детекций опорного кадра (reference - номер из reuse); если за время
+        инференса опорным стал другой кадр, детекции к нему не относятся и не сохраняются"""
+        with self._lock:
+            if reference == self._generation:
+                self._detections = [dict(obj) for obj in detected_objects]
@@ -0,0 +1,256 @@
+"""
+Хранилище истории запросов на SQLite (append-only, с индексами по id и времени)
+"""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+
+def normalize_bound(value):
+    """Граница периода в формате поля timestamp (ISO с 'T', местное время): строки сравниваются
+    посимвольно, поэтому '2026-01-26 10:30' без приведения захватил бы весь день.
+    Некорректная строка - ValueError"""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat()
+
+
+class HistoryStore:
+    """История запросов в SQLite: O(1) добавление, поиск по индексу, безопасная запись из нескольких потоков и процессов"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        """Отдельное соединение на каждый поток"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS history (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT NOT NULL UNIQUE,
+                    timestamp TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)')
+
+            # Накопительная статистика, обновляется в той же транзакции, что и запись истории
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stats_totals (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stats_classes (
+                    class TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS stats_buckets (
+                    granularity TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    requests INTEGER NOT NULL,
+                    luggage INTEGER NOT NULL,
+                    PRIMARY KEY (granularity, bucket)
+                )
+            ''')
+
+            # База, созданная до появления статистики, пересчитывается один раз
+            has_stats = conn.execute('SELECT 1 FROM stats_totals LIMIT 1').fetchone()
+            has_history = conn.execute('SELECT 1 FROM history LIMIT 1').fetchone()
+            if has_history and not has_stats:
+                for (data,) in conn.execute('SELECT data FROM history ORDER BY seq').fetchall():
+                    self._update_stats(conn, json.loads(data))
+
+    @staticmethod
+    def _update_stats(conn, entry):
+        """Добавление записи в итоги, счетчики классов и почасовые/посуточные корзины"""
+        luggage = entry.get('luggage_count', 0)
+        upsert_total = ('INSERT INTO stats_totals (name, value) VALUES (?, ?) '
+                        'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value')
+        conn.execute(upsert_total, ('total_requests', 1))
+        conn.execute(upsert_total, ('total_luggage', luggage))
+
+        class_counts = {}
+        for obj in entry.get('detected_objects', []):
+            class_counts[obj['class']] = class_counts.get(obj['class'], 0) + 1
+        conn.executemany(
+            'INSERT INTO stats_classes (class, count) VALUES (?, ?) '
+            'ON CONFLICT(class) DO UPDATE SET count = count + excluded.count',
+            list(class_counts.items())
+        )
+
+        # timestamp в ISO-формате: час - первые 13 символов, день - первые 10
+        timestamp = entry['timestamp']
+        conn.executemany(
+            'INSERT INTO stats_buckets (granularity, bucket, requests, luggage) VALUES (?, ?, 1, ?) '
+            'ON CONFLICT(granularity, bucket) DO UPDATE SET '
+            'requests = requests + 1, luggage = luggage + excluded.luggage',
+            [('hour', timestamp[:13], luggage), ('day', timestamp[:10], luggage)]
+        )
+
+    def _insert(self, conn, entry):
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO history (id, timestamp, data) VALUES (?, ?, ?)',
+            (entry['id'], entry['timestamp'], json.dumps(entry, ensure_ascii=False))
+        )
+        if cursor.rowcount == 1:
+            self._update_stats(conn, entry)
+
+    def append(self, entry):
+        """Добавление записи в конец истории"""
+        conn = self._connect()
+        with conn:
+            self._insert(conn, entry)
+
+    def append_many(self, entries):
+        """Добавление нескольких записей одной транзакцией"""
+        conn = self._connect()
+        with conn:
+            for entry in entries:
+                self._insert(conn, entry)
+
+    def get(self, entry_id):
+        """Поиск записи по id (по индексу)"""
+        row = self._connect().execute('SELECT data FROM history WHERE id = ?', (entry_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self):
+        """Количество записей (из накопительной статистики, без обхода таблицы)"""
+        row = self._connect().execute("SELECT value FROM stats_totals WHERE name = 'total_requests'").fetchone()
+        return row[0] if row else 0
+
+    def version(self):
+        """Версия истории: растет с каждой новой записью (для кэширования производных данных)"""
+        return self._connect().execute('SELECT MAX(seq) FROM history').fetchone()[0] or 0
+
+    def stats(self):
+        """Итоговая статистика за все время: O(1) относительно размера истории"""
+        conn = self._connect()
+        totals = dict(conn.execute('SELECT name, value FROM stats_totals').fetchall())
+        total_requests = totals.get('total_requests', 0)
+        total_luggage = totals.get('total_luggage', 0)
+        return {
+            'total_requests': total_requests,
+            'total_luggage': total_luggage,
+            'avg_luggage': total_luggage / total_requests if total_requests > 0 else 0,
+            'classes': dict(conn.execute('SELECT class, count FROM stats_classes ORDER BY count DESC').fetchall())
+        }
+
+    def buckets(self, granularity, since=None, until=None):
+        """Почасовые ('hour') или посуточные ('day') итоги в диапазоне времени"""
+        prefix_len = 13 if granularity == 'hour' else 10
+        since, until = normalize_bound(since), normalize_bound(until)
+        query = 'SELECT bucket, requests, luggage FROM stats_buckets WHERE granularity = ?'
+        params = [granularity]
+        if since:
+            query += ' AND bucket >= ?'
+            params.append(since[:prefix_len])
+        if until:
+            query += ' AND bucket < ?'
+            params.append(until[:prefix_len])
+        rows = self._connect().execute(query + ' ORDER BY bucket', params).fetchall()
+        return [{'bucket': bucket, 'requests': requests, 'luggage': luggage} for bucket, requests, luggage in rows]
+
+    def totals(self, since=None, until=None):
+        """Число запросов и багажа за период [since, until): целые часы - из почасовых корзин,
+        неполные часы на краях периода - по записям (индекс по времени)"""
+        since, until = normalize_bound(since), normalize_bound(until)
+        if since and until and since >= until:
+            return 0, 0
+        conn = self._connect()
+
+        def exact(start, end):
+            row = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(json_extract(data, '$.luggage_count')), 0) "
+                'FROM history WHERE timestamp >= ? AND timestamp < ?', (start, end)
+            ).fetchone()
+            return row[0], row[1]
+
+        def partial_hour(bound):
+            return len(bound) > 13 and bound[13:].strip(':.0') != ''
+
+        if since and until and since[:13] == until[:13]:
+            return exact(since, until)
+
+        requests = luggage = 0
+        first_hour = since
+        if since and partial_hour(since):
+            next_hour = datetime.strptime(since[:13], '%Y-%m-%dT%H') + timedelta(hours=1)
+            first_hour = next_hour.strftime('%Y-%m-%dT%H:00:00')
+            head = exact(since, first_hour)
+            requests, luggage = requests + head[0], luggage + head[1]
+        if until and partial_hour(until):
+            tail = exact(until[:13], until)
+            requests, luggage = requests + tail[0], luggage + tail[1]
+        for bucket in self.buckets('hour', first_hour, until):
+            requests += bucket['requests']
+            luggage += bucket['luggage']
+        return requests, luggage
+
+    @staticmethod
+    def _filters(since=None, until=None, object_class=None, cursor=None, newest_first=False):
+        """Условия WHERE для выборки: время (ISO-строки), класс объекта, курсор по seq"""
+        conditions, params = [], []
+        since, until = normalize_bound(since), normalize_bound(until)
+        if since:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            conditions.append('timestamp < ?')
+            params.append(until)
+        if object_class:
+            conditions.append(
+                "EXISTS (SELECT 1 FROM json_each(data, '$.detected_objects') "
+                "WHERE json_extract(value, '$.class') = ?)"
+            )
+            params.append(object_class)
+        if cursor is not None:
+            conditions.append('seq < ?' if newest_first else 'seq > ?')
+            params.append(cursor)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return where, params
+
+    def iter_entries(self, since=None, until=None, object_class=None, newest_first=False):
+        """Записи в порядке добавления (или обратном), без загрузки всей истории в память"""
+        where, params = self._filters(since, until, object_class)
+        order = 'DESC' if newest_first else 'ASC'
+        for (data,) in self._connect().execute(f'SELECT data FROM history{where} ORDER BY seq {order}', params):
+            yield json.loads(data)
+
+    def page(self, limit, cursor=None, since=None, until=None, object_class=None):
+        """Страница записей от новых к старым; возвращает (записи, курсор следующей страницы)"""
+        where, params = self._filters(since, until, object_class, cursor, newest_first=True)
+        rows = self._connect().execute(
+            f'SELECT seq, data FROM history{where} ORDER BY seq DESC LIMIT ?', params + [limit + 1]
+        ).fetchall()
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [json.loads(data) for _, data in rows[:limit]], next_cursor
+
+    def import_json(self, json_path):
+        """Однократный перенос истории из старого history.json в пустую базу"""
+        if self.count() > 0 or not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        self.append_many(entries)
+        return len(entries)
@@ -0,0 +1,234 @@
+"""
+Пул процессов для инференса: своя модель в каждом процессе,
+ограниченная очередь и динамическое объединение запросов в батчи
+"""
+import itertools
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import wait as wait_connections
+
+
+class InferenceQueueFull(Exception):
+    """Очередь инференса заполнена (отвечаем HTTP 429)"""
+
+
+def _worker_main(model_path, max_batch, batch_timeout, num_threads, task_queue, result_conn):
+    """Процесс-воркер: собирает задачи в батч и прогоняет их через свою копию модели.
+    Результаты идут в свой канал воркера; отправка синхронная, поэтому перед аварийным
+    завершением родитель успевает получить все, что воркер отправил, включая служебное
+    сообщение со списком задач текущего батча"""
+    # Ctrl+C приходит всей группе процессов: воркер завершает родитель, иначе ожидающие результата зависнут
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import torch
+    from detector import LuggageDetector
+
+    torch.set_num_threads(num_threads)
+    detector = LuggageDetector(model_path)
+    detector.warmup((1, max_batch))
+    result_conn.send((None, 'ready', None, None))  # Воркер прогрет и готов брать задачи
+
+    stopping = False
+    while not stopping:
+        task = task_queue.get()
+        if task is None:
+            break
+        batch = [task]
+
+        # Добираем в батч задачи, пришедшие в течение batch_timeout
+        deadline = time.monotonic() + batch_timeout
+        while len(batch) < max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                task = task_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if task is None:
+                stopping = True
+                break
+            batch.append(task)
+
+        result_conn.send((None, 'batch', None, [t[0] for t in batch]))  # Задачи, которые пропадут при падении
+        try:
+            timings = {'batch_size': len(batch)}
+            detections = detector.detect([t[1] for t in batch], [t[2] for t in batch], timings)
+            # Длительность этапов отправляется один раз на батч, с первым результатом
+            for index, ((task_id, _, _), detected_objects) in enumerate(zip(batch, detections)):
+                result_conn.send((task_id, detected_objects, None, timings if index == 0 else None))
+        except Exception as e:
+            for task_id, _, _ in batch:
+                result_conn.send((task_id, None, str(e), None))
+
+
+class InferencePool:
+    """Планировщик инференса поверх пула процессов.
+    Воркеры запускаются через spawn: главный модуль (например, app.py) заново выполняется в каждом
+    из них как __mp_main__, поэтому код уровня модуля там должен оставаться легким.
+    Аварийно завершившийся воркер перезапускается, его незавершенные задачи получают ошибку"""
+
+    def __init__(self, model_path, workers, max_queue, max_batch, batch_timeout, on_timings=None):
+        """on_timings(timings) вызывается для каждого батча с длительностью этапов в воркере"""
+        self._ctx = multiprocessing.get_context('spawn')
+        self.max_queue = max_queue
+        self._task_queue = self._ctx.Queue()
+        self._futures = {}
+        self._cond = threading.Condition()
+        self._ids = itertools.count()
+        self._ready = set()  # Номера прогретых воркеров
+        self._in_flight = {}  # Номер воркера -> id задач батча, который он сейчас обрабатывает
+        self._workers = {}  # Номер воркера -> (процесс, канал результатов)
+        self._on_timings = on_timings
+        self._stopping = False
+        self._failure = None  # Причина, по которой не осталось ни одного воркера
+
+        # Потоки torch делятся между воркерами, чтобы не перегружать ядра
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        self._worker_args = (model_path, max_batch, batch_timeout, num_threads, self._task_queue)
+        for worker_id in range(workers):
+            self._start_worker(worker_id)
+
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+
+    def _start_worker(self, worker_id):
+        reader, writer = self._ctx.Pipe(duplex=False)
+        worker = self._ctx.Process(target=_worker_main, args=self._worker_args + (writer,), daemon=True)
+        worker.start()
+        writer.close()  # Конец канала остается только у воркера: при его завершении чтение получит EOF
+        self._workers[worker_id] = (worker, reader)
+
+    def ready_workers(self):
+        """Количество воркеров, загрузивших и прогревших модель"""
+        with self._cond:
+            return len(self._ready)
+
+    def failure(self):
+        """Описание ошибки, если все воркеры завершились, не загрузив модель (иначе None)"""
+        with self._cond:
+            return self._failure
+
+    def queue_depth(self):
+        """Количество изображений, ожидающих результата"""
+        with self._cond:
+            return len(self._futures)
+
+    def submit(self, images, conf_threshold, wait=False):
+        """Постановка изображений в очередь; без wait при переполнении - InferenceQueueFull.
+        Если воркеров не осталось - сразу RuntimeError, а не ожидание до таймаута"""
+        with self._cond:
+            def has_room():
+                return not self._workers or not self._futures or len(self._futures) + len(images) <= self.max_queue
+
+            if wait:
+                self._cond.wait_for(has_room)
+            elif not has_room():
+                raise InferenceQueueFull('Очередь инференса заполнена')
+            if not self._workers:
+                raise RuntimeError(self._failure or 'Пул инференса остановлен')
+
+            futures = []
+            for img in images:
+                task_id = next(self._ids)
+                future = Future()
+                self._futures[task_id] = future
+                futures.append(future)
+                self._task_queue.put((task_id, img, conf_threshold))
+        return futures
+
+    def infer(self, images, conf_threshold, wait=False, timeout=None):
+        """Детекции багажа для каждого изображения (блокирует до получения результата).
+        timeout - общий срок ожидания в секундах; по его истечении задачи снимаются с учета
+        (не занимают место в очереди) и выбрасывается TimeoutError"""
+        futures = self.submit(images, conf_threshold, wait)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        try:
+            return [
+                future.result(None if deadline is None else max(0.0, deadline - time.monotonic()))
+                for future in futures
+            ]
+        except FutureTimeoutError:
+            self._discard(futures)
+            raise TimeoutError('Истекло время ожидания инференса')
+
+    def _discard(self, futures):
+        """Снятие задач, результат которых больше не ждут"""
+        futures = set(futures)
+        with self._cond:
+            for task_id in [task_id for task_id, future in self._futures.items() if future in futures]:
+                del self._futures[task_id]
+            self._cond.notify_all()
+
+    def _worker_exited(self, worker_id):
+        """Воркер завершился: его незавершенные задачи получают ошибку, прогретый воркер перезапускается
+        (не сумевший даже загрузить модель - нет, он упадет снова)"""
+        with self._cond:
+            worker, reader = self._workers.pop(worker_id)
+            reader.close()
+            worker.join()
+            lost = [self._futures.pop(task_id) for task_id in self._in_flight.pop(worker_id, ())
+                    if task_id in self._futures]
+            if worker_id in self._ready:
+                self._ready.discard(worker_id)
+                if not self._stopping:
+                    self._start_worker(worker_id)
+            if not self._workers:
+                # Задачи брать некому
+                if not self._stopping:
+                    self._failure = f'Все процессы инференса завершились (последний - с кодом {worker.exitcode})'
+                lost.extend(self._futures.values())
+                self._futures.clear()
+            self._cond.notify_all()
+        for future in lost:
+            future.set_exception(RuntimeError(f'Процесс инференса завершился с кодом {worker.exitcode}'))
+
+    def _collect_results(self):
+        while True:
+            readers = {reader: worker_id for worker_id, (_, reader) in list(self._workers.items())}
+            if not readers:
+                return
+            for reader in wait_connections(list(readers)):
+                worker_id = readers[reader]
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    # Канал закрыт: воркер завершился, все отправленное им уже прочитано
+                    self._worker_exited(worker_id)
+                    continue
+                self._handle_message(worker_id, message)
+
+    def _handle_message(self, worker_id, message):
+        task_id, detected_objects, error, timings = message
+        if task_id is None:
+            # Служебное сообщение воркера: 'ready' или 'batch' (id задач батча - на месте timings)
+            with self._cond:
+                if detected_objects == 'ready':
+                    self._ready.add(worker_id)
+                else:
+                    self._in_flight[worker_id] = timings
+            return
+        if timings is not None and self._on_timings is not None:
+            self._on_timings(timings)
+        with self._cond:
+            future = self._futures.pop(task_id, None)
+            self._cond.notify_all()
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(RuntimeError(error))
+        else:
+            future.set_result(detected_objects)
+
+    def shutdown(self):
+        with self._cond:
+            self._stopping = True
+            workers = [worker for worker, _ in self._workers.values()]
+        for _ in workers:
+            self._task_queue.put(None)
+        for worker in workers:
+            worker.join(timeout=5)
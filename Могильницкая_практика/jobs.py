@@ -0,0 +1,64 @@
+"""
+Фоновые задачи: долгая обработка и генерация отчетов без блокировки HTTP-запроса
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class JobManager:
+    """Очередь задач в текущем процессе; хранит статусы последних max_jobs задач"""
+
+    def __init__(self, max_workers, max_jobs):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, *args):
+        """Постановка задачи в очередь; func возвращает словарь с результатом
+        (ключ 'file' - путь к файлу для скачивания)"""
+        job_id = str(uuid.uuid4())
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'result': None,
+            'error': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict()
+        self._executor.submit(self._run, job, func, args)
+        return job_id
+
+    def _run(self, job, func, args):
+        job['status'] = 'running'
+        try:
+            job['result'] = func(*args)
+            job['status'] = 'done'
+        except Exception as e:
+            job['error'] = str(e)
+            job['status'] = 'error'
+        job['finished_at'] = datetime.now().isoformat()
+
+    def _evict(self):
+        """Удаление самых старых завершенных задач сверх лимита"""
+        excess = len(self._jobs) - self.max_jobs
+        if excess <= 0:
+            return
+        for job_id in [j for j, job in self._jobs.items() if job['status'] in ('done', 'error')][:excess]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
@@ -0,0 +1,132 @@
+"""
+Метрики сервиса в текстовом формате Prometheus: счетчики, гистограммы и вычисляемые значения
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Границы корзин по умолчанию (секунды): от 1 мс до 10 с
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Размер загрузки (байты): от 16 КБ до 64 МБ
+SIZE_BUCKETS = tuple(16384 * 4 ** i for i in range(7))
+
+
+def _format_labels(label, value, extra=None):
+    pairs = []
+    if label is not None:
+        pairs.append((label, value))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{str(val)}"' for name, val in pairs) + '}'
+
+
+class Counter:
+    """Монотонный счетчик, необязательно с одной меткой"""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = list(self._values.items())
+        for label_value, value in values:
+            lines.append(f'{self.name}{_format_labels(self.label, label_value)} {value}')
+        return lines
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами: наблюдение - O(log корзин) под блокировкой"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}  # значение метки -> [счетчики по корзинам, сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, label_value=None):
+        """Замер длительности блока кода"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, label_value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_list = [(label_value, list(counts), total, count)
+                           for label_value, (counts, total, count) in self._series.items()]
+        for label_value, counts, total, count in series_list:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label, label_value, ('le', bound))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label, label_value)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge:
+    """Значение, вычисляемое в момент запроса метрик (глубина очереди, объем кэша и т.д.)"""
+
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge',
+                f'{self.name} {self.func()}']
+
+
+class MetricsRegistry:
+    """Набор метрик сервиса; render() - ответ для /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, label=None):
+        return self._register(Counter(name, help_text, label))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, label=None):
+        return self._register(Histogram(name, help_text, buckets, label))
+
+    def gauge(self, name, help_text, func):
+        return self._register(Gauge(name, help_text, func))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
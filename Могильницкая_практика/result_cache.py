@@ -0,0 +1,134 @@
+"""
+Кэш результатов детекции по хэшу содержимого изображения
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from storage import cleanup_folder
+
+DISK_CLEANUP_EVERY = 100  # Проверка объема дискового уровня после стольких записей
+
+
+def make_cache_key(data, *settings):
+    """Ключ кэша: SHA-256 от байтов изображения и настроек (модель, порог и т.д.)"""
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """LRU-кэш в памяти с ограничением по объему и необязательным уровнем на диске
+    (на диске сверх disk_max_bytes удаляются самые старые файлы)"""
+
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_writes = 0
+        self._disk_cleanup_lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """(detected_objects, image_bytes) или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load_from_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, entry)
+        return entry
+
+    def put(self, key, detected_objects, image_bytes):
+        entry = (detected_objects, image_bytes)
+        with self._lock:
+            self._insert(key, entry)
+        if self.disk_dir:
+            self._save_to_disk(key, entry)
+            self._cleanup_disk()
+
+    def _insert(self, key, entry):
+        if key in self._entries:
+            return
+        size = len(entry[1])
+        if size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += size
+        # Вытеснение давно не использованных записей сверх лимита
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted_bytes)
+
+    def _disk_paths(self, key):
+        return os.path.join(self.disk_dir, f'{key}.json'), os.path.join(self.disk_dir, f'{key}.jpg')
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        json_path, image_path = self._disk_paths(key)
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                detected_objects = json.load(f)
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        except (OSError, ValueError):
+            return None
+        return detected_objects, image_bytes
+
+    def _save_to_disk(self, key, entry):
+        json_path, image_path = self._disk_paths(key)
+        # Сначала изображение, затем JSON: запись считается готовой, когда есть оба файла.
+        # Файлы пишутся во временные и переименовываются, поэтому читатель не увидит недописанный файл
+        suffix = f".{os.getpid()}.{time.monotonic_ns()}.tmp"
+        with open(image_path + suffix, 'wb') as f:
+            f.write(entry[1])
+        os.replace(image_path + suffix, image_path)
+        with open(json_path + suffix, 'w', encoding='utf-8') as f:
+            json.dump(entry[0], f, ensure_ascii=False)
+        os.replace(json_path + suffix, json_path)
+
+    def _cleanup_disk(self):
+        """Периодическое удаление самых старых файлов сверх disk_max_bytes"""
+        if self.disk_max_bytes is None:
+            return
+        with self._lock:
+            self._disk_writes += 1
+            if self._disk_writes % DISK_CLEANUP_EVERY:
+                return
+        # Очистка уже идет в другом потоке - эта запись ее не ждет
+        if self._disk_cleanup_lock.acquire(blocking=False):
+            try:
+                cleanup_folder(self.disk_dir, max_bytes=self.disk_max_bytes)
+            finally:
+                self._disk_cleanup_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_max_bytes': self.disk_max_bytes
+            }
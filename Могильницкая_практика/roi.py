@@ -0,0 +1,126 @@
+"""
+Области интереса (ROI) камер: кадр обрезается до ленты перед инференсом,
+рамки переводятся обратно в координаты полного кадра
+"""
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from detector import shift_detections
+
+MASK_COLOR = 114  # Цвет заливки вне многоугольника (тот же, что у рамки letterbox в YOLO)
+
+
+def parse_roi(data):
+    """Проверка ROI из конфигурации или запроса. Координаты - доли ширины и высоты кадра (0..1):
+    {'rect': [x1, y1, x2, y2]} или {'polygon': [[x, y], ...]} (не меньше трех точек).
+    Возвращает нормализованный словарь, при ошибке - ValueError"""
+    if not isinstance(data, dict) or ('rect' not in data and 'polygon' not in data):
+        raise ValueError('ROI должна быть объектом с ключом rect или polygon')
+    try:
+        if 'rect' in data:
+            x1, y1, x2, y2 = (float(v) for v in data['rect'])
+            points = [[x1, y1], [x2, y2]]
+        else:
+            points = [[float(x), float(y)] for x, y in data['polygon']]
+    except (TypeError, ValueError):
+        raise ValueError('Некорректные координаты ROI')
+    if any(not 0 <= v <= 1 for point in points for v in point):
+        raise ValueError('Координаты ROI задаются долями кадра от 0 до 1')
+    if 'rect' not in data:
+        if len(points) < 3:
+            raise ValueError('Многоугольник ROI должен содержать не меньше трех точек')
+        return {'polygon': points}
+    if x2 <= x1 or y2 <= y1:
+        raise ValueError('Прямоугольник ROI пустой')
+    return {'rect': [x1, y1, x2, y2]}
+
+
+def roi_pixels(roi, width, height):
+    """Ограничивающий прямоугольник ROI в пикселях и многоугольник (None для rect)"""
+    if 'rect' in roi:
+        x1, y1, x2, y2 = roi['rect']
+        x1, y1, x2, y2 = int(x1 * width), int(y1 * height), int(np.ceil(x2 * width)), int(np.ceil(y2 * height))
+        polygon = None
+    else:
+        polygon = np.round(np.array(roi['polygon']) * (width, height)).astype(np.int32)
+        (x1, y1), (x2, y2) = polygon.min(axis=0), polygon.max(axis=0) + 1
+    x1, y1 = min(int(x1), width - 1), min(int(y1), height - 1)
+    return (x1, y1, max(min(int(x2), width), x1 + 1), max(min(int(y2), height), y1 + 1)), polygon
+
+
+def roi_region(img, roi):
+    """Часть кадра внутри ограничивающего прямоугольника ROI (без копирования)"""
+    (x1, y1, x2, y2), _ = roi_pixels(roi, img.shape[1], img.shape[0])
+    return img[y1:y2, x1:x2]
+
+
+def crop_to_roi(img, roi):
+    """Кадр для модели: обрезка по ROI, вне многоугольника - заливка MASK_COLOR.
+    Возвращает (обрезанный кадр, смещение x, смещение y)"""
+    (x1, y1, x2, y2), polygon = roi_pixels(roi, img.shape[1], img.shape[0])
+    crop = img[y1:y2, x1:x2]
+    if polygon is not None:
+        mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+        cv2.fillPoly(mask, [polygon - (x1, y1)], 255)
+        crop = crop.copy()
+        crop[mask == 0] = MASK_COLOR
+    return crop, x1, y1
+
+
+def map_from_roi(detected_objects, roi, dx, dy, frame_shape):
+    """Рамки в координатах полного кадра; для многоугольника остаются объекты с центром внутри ROI"""
+    detected_objects = shift_detections(detected_objects, dx, dy) if dx or dy else detected_objects
+    if 'polygon' not in roi:
+        return detected_objects
+    _, polygon = roi_pixels(roi, frame_shape[1], frame_shape[0])
+    contour = polygon.astype(np.float32)
+    return [
+        obj for obj in detected_objects
+        if cv2.pointPolygonTest(contour, ((obj['bbox'][0] + obj['bbox'][2]) / 2,
+                                          (obj['bbox'][1] + obj['bbox'][3]) / 2), False) >= 0
+    ]
+
+
+class RoiConfig:
+    """ROI камер (ключ - идентификатор источника), хранятся в JSON-файле"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._rois = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._rois = {source: parse_roi(roi) for source, roi in json.load(f).items()}
+
+    def get(self, source):
+        with self._lock:
+            return self._rois.get(source)
+
+    def all(self):
+        with self._lock:
+            return dict(self._rois)
+
+    def set(self, source, data):
+        """Сохранение ROI камеры; возвращает нормализованную ROI (ValueError при ошибке)"""
+        roi = parse_roi(data)
+        with self._lock:
+            self._rois[source] = roi
+            self._save()
+        return roi
+
+    def delete(self, source):
+        with self._lock:
+            removed = self._rois.pop(source, None) is not None
+            if removed:
+                self._save()
+        return removed
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._rois, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,124 @@
+"""
+Хранение файлов: исходники с дедупликацией по содержимому, миниатюры результатов,
+очистка каталогов по возрасту и объему
+"""
+import hashlib
+import os
+import shutil
+import time
+
+import cv2
+import numpy as np
+
+
+class MediaStore:
+    """Исходные загрузки, адресуемые по SHA-256 содержимого: одинаковые файлы хранятся один раз.
+    Ключ - '<sha256>.<расширение>', файл лежит в подкаталоге по первым двум символам хэша"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key_for(data, extension):
+        return f"{hashlib.sha256(data).hexdigest()}.{extension.lower()}"
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def exists(self, key):
+        return bool(key) and os.path.exists(self.path(key))
+
+    def _touch_or_prepare(self, path):
+        """True, если файл уже есть (время обновляется - свежий файл дольше живет при очистке)"""
+        if os.path.exists(path):
+            os.utime(path)
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return False
+
+    def save(self, key, data):
+        """Запись байтов под ключом из key_for (повторная загрузка того же файла не пишется)"""
+        path = self.path(key)
+        if self._touch_or_prepare(path):
+            return path
+        tmp_path = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def save_file(self, file_path, extension):
+        """Перенос уже записанного на диск файла (например, видео) в хранилище; возвращает ключ"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        key = f"{digest.hexdigest()}.{extension.lower()}"
+        path = self.path(key)
+        if self._touch_or_prepare(path):
+            os.remove(file_path)
+        else:
+            shutil.move(file_path, path)
+        return key
+
+
+def write_thumbnail(path, image_bytes, max_side, quality=80):
+    """Уменьшенная копия JPEG-результата (декодирование сразу в половинном размере дешевле полного)"""
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+    if img is None:
+        return False
+    scale = max_side / max(img.shape[:2])
+    if scale < 1:
+        img = cv2.resize(img, (int(img.shape[1] * scale), int(img.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if ok:
+        with open(path, 'wb') as f:
+            f.write(buffer.tobytes())
+    return ok
+
+
+def cleanup_folder(folder, max_bytes=None, max_age=None, min_age=60, skip_dirs=()):
+    """Удаление файлов старше max_age секунд, затем самых старых сверх max_bytes.
+    Файлы моложе min_age (еще пишутся) и временные .tmp не трогаются.
+    Возвращает (удалено файлов, освобождено байт, занято байт после очистки)"""
+    now = time.time()
+    files = []
+    removed_files = removed_bytes = 0
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) not in skip_dirs]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            age = now - stat.st_mtime
+            if name.endswith('.tmp') or age < min_age:
+                files.append((float('inf'), stat.st_size, None))  # Учитывается в объеме, но не удаляется
+                continue
+            if max_age is not None and age > max_age:
+                if _remove(path):
+                    removed_files += 1
+                    removed_bytes += stat.st_size
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    if max_bytes is not None and total > max_bytes:
+        for _, size, path in sorted(files, key=lambda f: f[0]):
+            if total <= max_bytes or path is None:
+                break
+            if _remove(path):
+                total -= size
+                removed_files += 1
+                removed_bytes += size
+    return removed_files, removed_bytes, total
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
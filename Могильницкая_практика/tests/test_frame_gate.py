@@ -0,0 +1,60 @@
+"""
+Тесты фильтра неизменившихся кадров
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from frame_gate import FrameGate
+
+DETECTIONS = [{'class': 'suitcase', 'confidence': 0.9, 'bbox': [0, 0, 10, 10]}]
+
+
+def frame(value=0):
+    return np.full((120, 160, 3), value, dtype=np.uint8)
+
+
+def test_reuse_after_remember():
+    gate = FrameGate()
+    reused, reference = gate.reuse(frame())
+    assert reused is None
+    gate.remember(DETECTIONS, reference)
+    reused, reference = gate.reuse(frame())
+    assert reused == DETECTIONS and reference is None
+    assert gate.skipped == 1
+
+
+def test_no_skip_counted_without_detections():
+    # Инференс опорного кадра не удался (например, очередь заполнена) - remember не вызывался
+    gate = FrameGate()
+    gate.reuse(frame())
+    reused, reference = gate.reuse(frame())
+    assert reused is None and reference is not None
+    assert gate.skipped == 0
+
+
+def test_stale_detections_not_attached_to_new_reference():
+    gate = FrameGate()
+    _, first = gate.reuse(frame(0))
+    _, second = gate.reuse(frame(255))  # Опорным стал другой кадр, пока первый еще обрабатывался
+    gate.remember([], second)
+    gate.remember(DETECTIONS, first)  # Результат первого кадра пришел последним
+    assert gate.reuse(frame(255))[0] == []
+
+
+def test_changed_frame_becomes_reference():
+    gate = FrameGate()
+    assert gate.changed(frame(0))
+    assert not gate.changed(frame(0))
+    assert gate.changed(frame(255))
+    assert gate.skipped == 1
+
+
+def test_forced_inference_after_max_skips():
+    gate = FrameGate(max_skips=2)
+    _, reference = gate.reuse(frame())
+    gate.remember(DETECTIONS, reference)
+    assert gate.reuse(frame())[0] is not None
+    assert gate.reuse(frame())[0] is not None
+    assert gate.reuse(frame())[0] is None
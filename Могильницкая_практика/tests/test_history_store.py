@@ -0,0 +1,122 @@
+"""
+Тесты хранилища истории: итоги за период, фильтры, постраничная выдача и пересчет статистики
+"""
+import random
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from history_store import HistoryStore, normalize_bound
+
+BASE = datetime(2026, 1, 25)
+
+
+def make_entry(timestamp, luggage_count=1, classes=('suitcase',)):
+    return {
+        'id': str(uuid.uuid4()),
+        'timestamp': timestamp.isoformat(),
+        'filename': 'frame.jpg',
+        'luggage_count': luggage_count,
+        'detected_objects': [{'class': cls, 'confidence': 0.9, 'bbox': [0, 0, 10, 10]} for cls in classes]
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / 'history.db'))
+
+
+@pytest.fixture
+def random_history(store):
+    rng = random.Random(7)
+    entries = []
+    for _ in range(2000):
+        moment = BASE + timedelta(seconds=rng.randint(0, 3 * 86400), microseconds=rng.randint(0, 999999))
+        entries.append(make_entry(moment, rng.randint(0, 5)))
+    store.append_many(entries)
+    return entries
+
+
+def brute_totals(entries, since, until):
+    since, until = normalize_bound(since), normalize_bound(until)
+    selected = [e for e in entries
+                if (not since or e['timestamp'] >= since) and (not until or e['timestamp'] < until)]
+    return len(selected), sum(e['luggage_count'] for e in selected)
+
+
+BOUNDS = [
+    None,
+    '2026-01-25',  # Дата
+    '2026-01-26',
+    '2026-01-25T10',  # Целый час
+    '2026-01-26T05:00:00',
+    '2026-01-25T10:30',  # Неполный час
+    '2026-01-26T23:59:59.500000',  # Доли секунды
+    '2026-01-26 10:30',  # Пробел вместо 'T'
+    '2026-01-25 10:30:15',
+]
+
+
+@pytest.mark.parametrize('since', BOUNDS)
+@pytest.mark.parametrize('until', BOUNDS)
+def test_totals_match_brute_force(store, random_history, since, until):
+    assert store.totals(since, until) == brute_totals(random_history, since, until)
+
+
+def test_space_separated_bound_filters_by_time(store):
+    store.append(make_entry(datetime(2026, 1, 26, 5)))
+    store.append(make_entry(datetime(2026, 1, 26, 11)))
+    entries = list(store.iter_entries(since='2026-01-26 10:30'))
+    assert [e['timestamp'] for e in entries] == ['2026-01-26T11:00:00']
+    assert store.totals(since='2026-01-26 10:30') == (1, 1)
+
+
+def test_invalid_bound_rejected(store):
+    with pytest.raises(ValueError):
+        store.totals(since='вчера')
+
+
+def test_page_cursor_walks_newest_first(store):
+    entries = [make_entry(BASE + timedelta(minutes=i)) for i in range(7)]
+    store.append_many(entries)
+    seen, cursor = [], None
+    while True:
+        page, cursor = store.page(3, cursor)
+        seen.extend(e['id'] for e in page)
+        if cursor is None:
+            break
+    assert seen == [e['id'] for e in reversed(entries)]
+
+
+def test_page_class_and_time_filters(store):
+    store.append(make_entry(BASE, classes=('suitcase',)))
+    backpack = make_entry(BASE + timedelta(hours=1), classes=('backpack', 'suitcase'))
+    store.append(backpack)
+    store.append(make_entry(BASE + timedelta(hours=2), classes=('handbag',)))
+
+    page, cursor = store.page(10, object_class='backpack')
+    assert [e['id'] for e in page] == [backpack['id']] and cursor is None
+    page, _ = store.page(10, since=(BASE + timedelta(minutes=30)).isoformat(), object_class='suitcase')
+    assert [e['id'] for e in page] == [backpack['id']]
+
+
+def test_stats_rebuilt_for_database_without_stats(tmp_path):
+    db_path = str(tmp_path / 'history.db')
+    entries = [make_entry(BASE + timedelta(hours=i), luggage_count=i, classes=('suitcase',) * i) for i in range(4)]
+    HistoryStore(db_path).append_many(entries)
+
+    # База из версии без накопительной статистики: таблицы итогов пустые
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for table in ('stats_totals', 'stats_classes', 'stats_buckets'):
+            conn.execute(f'DELETE FROM {table}')
+    conn.close()
+
+    store = HistoryStore(db_path)
+    stats = store.stats()
+    assert stats['total_requests'] == 4
+    assert stats['total_luggage'] == 6
+    assert stats['classes'] == {'suitcase': 6}
+    assert store.totals('2026-01-25T01:00', '2026-01-25T03') == (2, 3)
@@ -0,0 +1,74 @@
+"""
+Тесты инференса по тайлам: нарезка кадра, перенос рамок и слияние детекций соседних тайлов
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+from detector import make_tiles, merge_detections, shift_detections, tile_offsets
+
+
+def detection(bbox, confidence=0.9, cls='suitcase'):
+    return {'class': cls, 'confidence': confidence, 'bbox': bbox}
+
+
+def test_tile_offsets_short_side_single_tile():
+    assert tile_offsets(300, 640, 512) == [0]
+    assert tile_offsets(640, 640, 512) == [0]
+
+
+def test_tile_offsets_last_tile_pinned_to_edge():
+    assert tile_offsets(1920, 640, 512) == [0, 512, 1024, 1280]
+    assert tile_offsets(700, 640, 512) == [0, 60]
+
+
+def test_tile_offsets_no_duplicate_when_stride_fits():
+    assert tile_offsets(1664, 640, 512) == [0, 512, 1024]
+
+
+def test_make_tiles_frame_smaller_than_tile_in_one_dimension():
+    img = np.zeros((300, 1920, 3), dtype=np.uint8)
+    tiles = make_tiles(img, 640, 0.2)
+    assert [(x, y) for x, y, _ in tiles] == [(0, 0), (512, 0), (1024, 0), (1280, 0)]
+    assert all(tile.shape == (300, 640, 3) for _, _, tile in tiles)
+
+
+def test_make_tiles_cover_whole_frame():
+    img = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    tiles = make_tiles(img, 640, 0.2)
+    assert all(tile.shape == (640, 640, 3) for _, _, tile in tiles)
+    assert max(x for x, _, _ in tiles) + 640 == 1920
+    assert max(y for _, y, _ in tiles) + 640 == 1080
+
+
+def test_single_detection_unchanged():
+    detected_objects = [detection([0, 0, 10, 10])]
+    assert merge_detections(detected_objects) == detected_objects
+
+
+def test_cropped_box_suppressed_by_full_box():
+    full = detection([100, 100, 200, 200], confidence=0.8)
+    cropped = detection([100, 100, 140, 200], confidence=0.9)  # Обрезана краем тайла
+    assert merge_detections([full, cropped]) == [cropped]
+
+
+def test_equal_confidence_prefers_larger_box():
+    full = detection([100, 100, 200, 200])
+    cropped = detection([100, 100, 140, 200])
+    assert merge_detections([cropped, full]) == [full]
+
+
+def test_different_classes_kept():
+    detected_objects = [detection([0, 0, 50, 50]), detection([0, 0, 50, 50], cls='backpack')]
+    assert merge_detections(detected_objects) == detected_objects
+
+
+def test_separate_objects_kept_in_order():
+    detected_objects = [detection([0, 0, 50, 50], 0.5), detection([60, 0, 110, 50], 0.9)]
+    assert merge_detections(detected_objects) == detected_objects
+
+
+def test_shift_detections():
+    shifted = shift_detections([detection([1, 2, 3, 4])], 10, 20)
+    assert shifted[0]['bbox'] == [11, 22, 13, 24]
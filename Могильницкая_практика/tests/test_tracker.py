@@ -0,0 +1,79 @@
+"""
+Тесты трекера багажа: подсчет пересечений линии и пропускная способность
+"""
+import pytest
+
+pytest.importorskip('numpy')
+
+from tracker import LuggageTracker, iou_matrix
+
+FRAME_SIZE = (100, 100)
+
+
+def luggage(y, x=40):
+    return {'class': 'suitcase', 'confidence': 0.9, 'bbox': [x, y, x + 20, y + 20]}
+
+
+def move_across(tracker, start_time, x=40, step=1.0):
+    """Один объект проходит сверху вниз через линию на середине кадра"""
+    crossings = 0
+    for i, y in enumerate(range(10, 80, 5)):
+        crossings += tracker.update([luggage(y, x)], FRAME_SIZE, start_time + i * step / 10)
+    return crossings
+
+
+def test_iou_matrix():
+    ious = iou_matrix([[0, 0, 10, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [20, 20, 30, 30]])
+    assert ious.shape == (1, 3)
+    assert ious[0, 0] == pytest.approx(1.0)
+    assert ious[0, 1] == pytest.approx(50 / 150)
+    assert ious[0, 2] == 0
+
+
+def test_crossing_counted_once():
+    tracker = LuggageTracker()
+    assert move_across(tracker, 0.0) == 1
+    assert tracker.line_crossings == 1
+    assert tracker.summary()['tracks_started'] == 1
+
+
+def test_objects_that_do_not_cross_are_not_counted():
+    tracker = LuggageTracker()
+    for i in range(20):
+        tracker.update([luggage(10)], FRAME_SIZE, i * 0.1)
+    assert tracker.line_crossings == 0
+
+
+def test_track_ids_reassigned_to_reused_detections():
+    tracker = LuggageTracker()
+    detected_objects = [luggage(10)]
+    tracker.update(detected_objects, FRAME_SIZE, 0.0)
+    track_id = detected_objects[0]['track_id']
+    # Те же словари (переиспользованные детекции) получают id заново, а не сохраняют старый
+    tracker.update(detected_objects, FRAME_SIZE, 0.1)
+    assert detected_objects[0]['track_id'] == track_id
+
+
+def test_throughput_uses_elapsed_time_before_window_fills():
+    tracker = LuggageTracker(throughput_window=60.0)
+    move_across(tracker, 0.0, x=0)
+    move_across(tracker, 10.0, x=40)
+    tracker.update([], FRAME_SIZE, 30.0)
+    # 2 пересечения за 30 секунд - 4 в минуту, а не 2 (деление на полное окно)
+    assert tracker.throughput_per_minute() == pytest.approx(4.0)
+
+
+def test_throughput_over_full_window():
+    tracker = LuggageTracker(throughput_window=60.0)
+    move_across(tracker, 0.0, x=0)
+    move_across(tracker, 100.0, x=40)
+    tracker.update([], FRAME_SIZE, 120.0)
+    # Первое пересечение вышло из окна, остается одно за 60 секунд
+    assert tracker.throughput_per_minute() == pytest.approx(1.0)
+
+
+def test_throughput_without_elapsed_time():
+    tracker = LuggageTracker()
+    assert tracker.throughput_per_minute() == 0.0
+    tracker.update([luggage(10)], FRAME_SIZE, 5.0)
+    assert tracker.throughput_per_minute() == 0.0
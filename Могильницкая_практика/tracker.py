@@ -0,0 +1,135 @@
+"""
+Сопровождение багажа между кадрами и подсчет уникальных объектов, пересекших линию
+"""
+from collections import deque
+
+import numpy as np
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Матрица IoU между двумя наборами рамок [x1, y1, x2, y2]"""
+    a = np.asarray(boxes_a, dtype=float).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=float).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+class LuggageTracker:
+    """IoU-трекер с виртуальной линией подсчета.
+
+    Состояние ограничено: трек удаляется, если не виден max_age кадров,
+    и активных треков не больше max_tracks. Багаж засчитывается один раз,
+    когда центр его рамки переходит через линию (line_position - доля ширины
+    или высоты кадра, line_axis - 'y' для горизонтальной линии, 'x' для вертикальной)"""
+
+    def __init__(self, line_position=0.5, line_axis='y', iou_threshold=0.3, max_age=15,
+                 max_tracks=256, throughput_window=60.0):
+        self.line_position = line_position
+        self.line_axis = line_axis
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_tracks = max_tracks
+        self.throughput_window = throughput_window
+        self.tracks = []
+        self.next_id = 1
+        self.frame_index = 0
+        self.line_crossings = 0
+        self._crossing_times = deque()
+        self._first_timestamp = None
+        self._last_timestamp = None
+
+    def _side(self, bbox, frame_size):
+        """По какую сторону линии находится центр рамки: -1 или 1"""
+        width, height = frame_size
+        if self.line_axis == 'x':
+            return -1 if (bbox[0] + bbox[2]) / 2 < self.line_position * width else 1
+        return -1 if (bbox[1] + bbox[3]) / 2 < self.line_position * height else 1
+
+    def update(self, detected_objects, frame_size, timestamp):
+        """Обработка очередного кадра. Объектам добавляется 'track_id';
+        возвращает количество новых пересечений линии на этом кадре"""
+        self.frame_index += 1
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+        self._last_timestamp = timestamp
+        for obj in detected_objects:
+            obj.pop('track_id', None)  # Повторно используемые детекции могут нести id прошлого кадра
+        matched_tracks = set()
+        new_crossings = 0
+
+        # Жадное сопоставление по убыванию IoU
+        if self.tracks and detected_objects:
+            ious = iou_matrix([t['bbox'] for t in self.tracks], [obj['bbox'] for obj in detected_objects])
+            matched_objects = set()
+            for flat_index in np.argsort(ious, axis=None)[::-1]:
+                track_index, obj_index = (int(i) for i in np.unravel_index(flat_index, ious.shape))
+                if ious[track_index, obj_index] < self.iou_threshold:
+                    break
+                if track_index in matched_tracks or obj_index in matched_objects:
+                    continue
+                matched_tracks.add(track_index)
+                matched_objects.add(obj_index)
+
+                track = self.tracks[track_index]
+                obj = detected_objects[obj_index]
+                side = self._side(obj['bbox'], frame_size)
+                if not track['counted'] and side != track['side']:
+                    track['counted'] = True
+                    new_crossings += 1
+                track.update(bbox=obj['bbox'], side=side, last_seen=self.frame_index)
+                obj['track_id'] = track['id']
+
+        # Удаление потерянных треков
+        self.tracks = [
+            t for i, t in enumerate(self.tracks)
+            if i in matched_tracks or self.frame_index - t['last_seen'] <= self.max_age
+        ]
+
+        # Новые треки для несопоставленных детекций
+        for obj in detected_objects:
+            if 'track_id' in obj:
+                continue
+            track = {
+                'id': self.next_id,
+                'bbox': obj['bbox'],
+                'side': self._side(obj['bbox'], frame_size),
+                'last_seen': self.frame_index,
+                'counted': False
+            }
+            self.next_id += 1
+            self.tracks.append(track)
+            obj['track_id'] = track['id']
+        if len(self.tracks) > self.max_tracks:
+            self.tracks.sort(key=lambda t: t['last_seen'])
+            self.tracks = self.tracks[-self.max_tracks:]
+
+        self.line_crossings += new_crossings
+        self._crossing_times.extend([timestamp] * new_crossings)
+        while self._crossing_times and timestamp - self._crossing_times[0] > self.throughput_window:
+            self._crossing_times.popleft()
+        return new_crossings
+
+    def throughput_per_minute(self):
+        """Уникальный багаж в минуту за последнее окно throughput_window секунд
+        (пока с первого кадра прошло меньше окна - за прошедшее время)"""
+        if self._first_timestamp is None:
+            return 0.0
+        elapsed = min(self.throughput_window, self._last_timestamp - self._first_timestamp)
+        if elapsed <= 0:
+            return 0.0
+        return len(self._crossing_times) * 60.0 / elapsed
+
+    def summary(self):
+        return {
+            'unique_luggage': self.line_crossings,
+            'tracks_started': self.next_id - 1,
+            'active_tracks': len(self.tracks),
+            'throughput_per_minute': round(self.throughput_per_minute(), 2)
+        }
@@ -0,0 +1,69 @@
+"""
+Общий цикл обработки видео для веб-сервера и пакетной обработки:
+чтение кадров, батчи для модели, пропуск неизменившихся кадров и трекинг.
+Здесь же настройки, которые должны совпадать у сервера и bulk_process.py
+"""
+from frame_gate import FrameGate
+from tracker import LuggageTracker
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov'}
+VIDEO_BATCH_SIZE = 8  # Количество кадров видео в одном вызове модели
+FRAME_GATE_PIXEL_DELTA = 25  # Изменение яркости пикселя (0-255), которое считается движением
+FRAME_GATE_CHANGE_RATIO = 0.005  # Доля изменившихся пикселей уменьшенного кадра, при которой вызывается модель
+FRAME_GATE_MAX_SKIPS = 150  # Принудительный инференс после стольких пропущенных кадров подряд
+TRACK_LINE_POSITION = 0.5  # Линия подсчета: доля высоты (или ширины) кадра
+TRACK_LINE_AXIS = 'y'  # 'y' - горизонтальная линия (лента движется вертикально в кадре), 'x' - вертикальная
+
+
+def create_frame_gate():
+    return FrameGate(FRAME_GATE_PIXEL_DELTA, FRAME_GATE_CHANGE_RATIO, max_skips=FRAME_GATE_MAX_SKIPS)
+
+
+def create_tracker():
+    return LuggageTracker(line_position=TRACK_LINE_POSITION, line_axis=TRACK_LINE_AXIS)
+
+
+def iter_video_frames(capture):
+    """Покадровое чтение видео без загрузки всего ролика в память"""
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        yield frame
+
+
+def iter_batches(items, batch_size):
+    """Группировка элементов генератора в батчи фиксированного размера"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_video_detections(capture, infer, batch_size, fps, changed=None, tracker=None):
+    """Детекции по кадрам видео. infer(frames) - детекции для списка кадров (один вызов модели на батч).
+    changed(frame) - нужен ли кадру инференс: неизменившийся кадр получает копию детекций последнего
+    обработанного моделью. С трекером детекции проходят через него по порядку кадров.
+    Выдает (номер кадра, кадр, детекции, вызывалась ли модель, новые пересечения линии)"""
+    frame_index = 0
+    last_detections = []
+    for batch in iter_batches(iter_video_frames(capture), batch_size):
+        is_changed = [changed(frame) for frame in batch] if changed is not None else [True] * len(batch)
+        changed_frames = [frame for frame, flag in zip(batch, is_changed) if flag]
+        detections = iter(infer(changed_frames) if changed_frames else [])
+        for frame, flag in zip(batch, is_changed):
+            if flag:
+                detected_objects = last_detections = next(detections)
+            else:
+                detected_objects = [dict(obj) for obj in last_detections]
+            new_crossings = 0
+            if tracker is not None:
+                height, width = frame.shape[:2]
+                new_crossings = tracker.update(detected_objects, (width, height), frame_index / fps)
+            yield frame_index, frame, detected_objects, flag, new_crossings
+            frame_index += 1